@@ -47,7 +47,7 @@ What is available
 
 Data types:
 
-* Strings (2.x: str/unicode, 3.3+: str), ints, floats, decimals, booleans
+* Strings (str and bytes), ints, floats, decimals, booleans
 * datetime.datetime, datetime.date, datetime.time
 * Json columns (for nested structures)
 * OneToMany and ManyToOne columns (for model references)
@@ -74,15 +74,13 @@ Other features:
 Getting started
 ===============
 
-1. Make sure you have Python 2.6, 2.7, or 3.3+ installed
+1. Make sure you have Python 3.6+ installed
 2. Make sure that you have Andy McCurdy's Redis client library installed:
    https://github.com/andymccurdy/redis-py/ or
    https://pypi.python.org/pypi/redis
-3. Make sure that you have the Python 2 and 3 compatibility library, 'six'
-   installed: https://pypi.python.org/pypi/six
-4. (optional) Make sure that you have the hiredis library installed for Python
-5. Make sure that you have a Redis server installed and available remotely
-6. Update the Redis connection settings for ``rom`` via
+3. (optional) Make sure that you have the hiredis library installed for Python
+4. Make sure that you have a Redis server installed and available remotely
+5. Update the Redis connection settings for ``rom`` via
    ``rom.util.set_connection_settings()`` (other connection update options,
    including per-model connections, can be read about in the ``rom.util``
    documentation)::
@@ -113,7 +111,7 @@ Getting started
         salt = salt or os.urandom(16)
         comp = salt + password
         out = sha256(comp).digest()
-        for i in xrange(PASSES-1):
+        for i in range(PASSES-1):
             out = sha256(out + comp).digest()
         return salt, out
 
@@ -173,8 +171,6 @@ it efficiently? I think so, and you should too.
 from datetime import datetime, date, time as dtime
 from decimal import Decimal as _Decimal
 
-import six
-
 _skip = None
 _skip = set(globals()) - set('__doc__')
 
@@ -199,7 +195,7 @@ COLUMN_TYPES = [Column, Integer, Boolean, Float, Decimal, DateTime, Date,
 Time, String, Text, Json, PrimaryKey, ManyToOne, ForeignModel, OneToMany,
 OneToOne, IndexOnly]
 
-NUMERIC_TYPES = six.integer_types + (float, _Decimal, datetime, date, dtime)
+NUMERIC_TYPES = (int, float, _Decimal, datetime, date, dtime)
 
 __all__ = [x for x in set(globals()) if x not in _skip and not x.startswith('_')]
 # could use a better order here; model, columns, query, util, index, exceptions
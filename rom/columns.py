@@ -14,11 +14,9 @@ from functools import wraps
 from itertools import product
 import json
 
-import six
-
 from .exceptions import (ORMError, InvalidOperation, ColumnError,
     MissingColumn, InvalidColumnValue, RestrictError)
-from .util import (_numeric_keygen, _string_keygen, _many_to_one_keygen,
+from .util import (_make_numeric_keygen, _string_keygen, _many_to_one_keygen,
     _boolean_keygen, dt2ts, ts2dt, t2ts, ts2t, session, _connect,
     STRING_INDEX_KEYGENS_STR)
 
@@ -30,16 +28,14 @@ _NUMERIC = (0, 0.0, _Decimal('0'), datetime(1970, 1, 1), date(1970, 1, 1), dtime
 NO_ACTION_DEFAULT = object()
 SKIP_ON_DELETE = object()
 ON_DELETE = ('no action', 'restrict', 'cascade', 'set null', 'set default')
-six.string_types_ex = six.string_types
-if six.PY3:
-    six.string_types_ex += (bytes,)
+_STRING_TYPES = (str, bytes)
 
 def is_numeric(allowed):
     return any(isinstance(i, allowed) for i in _NUMERIC)
 
 def is_string(allowed):
     allowed = (allowed,) if isinstance(allowed, type) else allowed
-    return any(issubclass(a, i) for a,i in product(allowed, six.string_types_ex))
+    return any(issubclass(a, i) for a,i in product(allowed, _STRING_TYPES))
 
 def _restrict(entity, attr, refs):
     name = entity._namespace
@@ -110,9 +106,11 @@ def _on_delete(ent):
     for self in to_delete:
         self.delete(skip_on_delete_i_really_mean_it=SKIP_ON_DELETE)
     for self in to_save:
-        # Careful not to resurrect deleted entities
+        # Careful not to resurrect deleted entities. Written now, even inside
+        # session.autopipe(), to keep the references consistent with the
+        # deletes above.
         if self._pk not in seen_d:
-            self.save()
+            self._save()()
 
 def _check_on_delete(on_delete, required, default):
     if on_delete is NO_ACTION_DEFAULT:
@@ -260,7 +258,7 @@ class Column(_Column):
             raise ColumnError("Missing valid class-level _allowed attribute on %r"%(type(self),))
 
         allowed = (self._allowed,) if isinstance(self._allowed, type) else self._allowed
-        is_integer = all(issubclass(x, six.integer_types) for x in allowed)
+        is_integer = all(issubclass(x, int) for x in allowed)
         if unique:
             if not (is_string(allowed) or is_integer):
                 raise ColumnError("Unique columns can only be strings or integers")
@@ -287,7 +285,7 @@ class Column(_Column):
 
         if index:
             keygen = keygen if keygen else (
-                _numeric_keygen if numeric else _string_keygen)
+                _make_numeric_keygen(allowed) if numeric else _string_keygen)
         elif prefix or suffix:
             keygen = keygen if keygen else _string_keygen
 
@@ -385,7 +383,7 @@ class Integer(Column):
         class MyModel(Model):
             col = Integer()
     '''
-    _allowed = six.integer_types
+    _allowed = int
     def _to_redis(self, value):
         return str(value)
 
@@ -429,7 +427,7 @@ class Float(Column):
         class MyModel(Model):
             col = Float()
     '''
-    _allowed = (float,) + six.integer_types
+    _allowed = (float, int)
 
 class Decimal(Column):
     '''
@@ -547,7 +545,7 @@ class Time(Column):
 
 class String(Column):
     '''
-    A plain string column (str in 2.x, bytes in 3.x). Trying to save unicode
+    A plain string column (bytes). Trying to save unicode
     strings will probably result in an error, if not corrupted data.
 
     All standard arguments and String/Text arguments supported. See ``Column``
@@ -565,7 +563,7 @@ class String(Column):
         class MyModel(Model):
             col = String()
     '''
-    _allowed = str if six.PY2 else bytes
+    _allowed = bytes
     def _to_redis(self, value):
         return value.decode('latin-1')
 
@@ -583,7 +581,7 @@ class String(Column):
 class Text(Column):
     '''
     A unicode string column. Behavior is more or less identical to the String
-    column type, except that unicode is supported (unicode in 2.x, str in 3.x).
+    column type, except that unicode is supported (str).
     UTF-8 is used by default as the encoding to bytes on the wire, which *will*
     affect ``rom.SIMPLE`` and ``rom.SIMPLE_CI`` indexes.
 
@@ -606,11 +604,11 @@ class Text(Column):
         class MyModel(Model):
             col = Text()
     '''
-    _allowed = six.text_type
+    _allowed = str
     def _to_redis(self, value):
-        return value.encode('utf-8') if six.PY2 else value
+        return value
     def _from_redis(self, value):
-        if isinstance(value, six.binary_type):
+        if isinstance(value, bytes):
             return value.decode('utf-8')
         return value
 
@@ -649,7 +647,7 @@ class PrimaryKey(Column):
         class MyModel(Model):
             id = PrimaryKey()
     '''
-    _allowed = six.integer_types
+    _allowed = int
 
     def __init__(self, index=False):
         Column.__init__(self, required=False, default=None, unique=False, index=index)
@@ -816,7 +814,7 @@ class ManyToOne(Column):
     def _to_redis(self, value):
         if not value:
             return None
-        if isinstance(value, six.integer_types):
+        if isinstance(value, int):
             return str(value)
         if value._new:
             # should spew a warning here
@@ -902,7 +900,7 @@ class ForeignModel(Column):
     def _from_redis(self, value):
         if isinstance(value, self._fmodel):
             return value
-        if isinstance(value, six.string_types_ex) and value.isdigit():
+        if isinstance(value, _STRING_TYPES) and value.isdigit():
             value = int(value, 10)
         return self._fmodel.get(value)
 
@@ -916,7 +914,7 @@ class ForeignModel(Column):
     def _to_redis(self, value):
         if not value:
             return None
-        if isinstance(value, six.integer_types):
+        if isinstance(value, int):
             return str(value)
         return str(value.id)
 
@@ -13,10 +13,8 @@ import json
 import re
 import uuid
 
-import six
-
 from .exceptions import QueryError
-from .util import _prefix_score, _script_load, _to_score
+from .util import _execute_transaction, _prefix_score, _script_load, _to_score
 
 _skip = None
 _skip = set(globals()) - set(['__doc__'])
@@ -30,10 +28,6 @@ GeoIndex = namedtuple('GeoIndex', 'name callback')
 
 SPECIAL = re.compile('([-().%[^$])')
 def _pattern_to_lua_pattern(pat):
-    if isinstance(pat, six.string_types) and not isinstance(pat, str):
-        # XXX: Decode only py2k unicode. Why can't we run the unicode
-        # pattern through the re? -JM
-        pat = pat.encode('utf-8')
     # We use '-' instead of '*' to get the shortest matches possible, which is
     # usually the desired case for pattern matching.
     return SPECIAL.sub('%\1', pat) \
@@ -45,10 +39,6 @@ def _pattern_to_lua_pattern(pat):
 
 def _find_prefix(pat):
     pat = SPECIAL.sub('%\1', pat)
-    if isinstance(pat, six.string_types) and not isinstance(pat, str):
-        # XXX: Decode only py2k unicode. Why can't we run the unicode
-        # pattern through the re? -JM
-        pat = pat.encode('utf-8')
     x = []
     for i in pat:
         if i in '?*+!':
@@ -60,16 +50,10 @@ MAX_PREFIX_SCORE = _prefix_score(7*'\xff', True)
 def _start_end(prefix):
     return _prefix_score(prefix), (_prefix_score(prefix, True) if prefix else MAX_PREFIX_SCORE)
 
-if six.PY3:
-    def _ts(v):
-        if not isinstance(v, str):
-            return v.decode('utf-8')
-        return v
-else:
-    def _ts(v):
-        if not isinstance(v, unicode):
-            return v.decode('utf-8')
-        return v
+def _ts(v):
+    if not isinstance(v, str):
+        return v.decode('utf-8')
+    return v
 
 class GeneralIndex(object):
     '''
@@ -124,7 +108,7 @@ class GeneralIndex(object):
         if filters:
             # reorder filters based on the size of the underlying set/zset
             for fltr in filters:
-                if isinstance(fltr, six.string_types):
+                if isinstance(fltr, str):
                     estimate_work_lua(pipe, '%s:%s:idx'%(self.namespace, fltr), None)
                 elif isinstance(fltr, Prefix):
                     estimate_work_lua(pipe, '%s:%s:pre'%(self.namespace, fltr.attr), fltr.prefix)
@@ -140,7 +124,7 @@ class GeneralIndex(object):
                     estimate_work_lua(pipe, '%s:%s:idx'%(self.namespace, fltr[0]), fltr[1:3])
                 else:
                     raise QueryError("Don't know how to handle a filter of: %r"%(fltr,))
-            sizes = list(enumerate(pipe.execute()))
+            sizes = list(enumerate(_execute_transaction(pipe)))
             sizes.sort(key=lambda x:abs(x[1]))
             sfilters = [filters[x[0]] for x in sizes]
 
@@ -163,7 +147,7 @@ class GeneralIndex(object):
                         ('%s:%s:idx'%(self.namespace, fi), 0) for fi in fltr))
                     intersect(temp_id, {temp_id: 0, temp_id2: 0})
                     pipe.delete(temp_id2)
-            if isinstance(fltr, six.string_types):
+            if isinstance(fltr, str):
                 # simple string/tag search
                 intersect(temp_id, {temp_id:0, '%s:%s:idx'%(self.namespace, fltr):0})
             elif isinstance(fltr, Prefix):
@@ -279,14 +263,14 @@ class GeneralIndex(object):
         # handle returning the temporary result key
         if timeout is not None:
             pipe.expire(temp_id, timeout)
-            pipe.execute()
+            _execute_transaction(pipe)
             return temp_id
 
         offset = offset if offset is not None else 0
         end = (offset + count - 1) if count and count > 0 else -1
         pipe.zrange(temp_id, offset, end)
         pipe.delete(temp_id)
-        return pipe.execute()[-2]
+        return _execute_transaction(pipe)[-2]
 
     def count(self, conn, filters):
         '''
@@ -295,10 +279,18 @@ class GeneralIndex(object):
         For the meaning of what the ``filters`` argument means, see the
         ``.search()`` method docs.
         '''
+        if len(filters) == 1 and isinstance(filters[0], tuple) and len(filters[0]) == 3:
+            # a single numeric range can be counted directly from the index,
+            # without building (and deleting) a temporary ZSET
+            fltr, mi, ma = filters[0]
+            return conn.zcount('%s:%s:idx'%(self.namespace, fltr),
+                '-inf' if mi is None else _to_score(mi),
+                'inf' if ma is None else _to_score(ma))
+
         pipe, intersect, temp_id = self._prepare(conn, filters)
         pipe.zcard(temp_id)
         pipe.delete(temp_id)
-        return pipe.execute()[-2]
+        return _execute_transaction(pipe)[-2]
 
 _redis_prefix_lua = _script_load('''
 -- first unpack most of our passed variables
@@ -9,14 +9,11 @@ Released under the LGPL license version 2.1 and version 3 (you can choose
 which you'd like to be bound under).
 '''
 
-from __future__ import print_function
 from collections import defaultdict
 import json
-import sys
 import warnings
 
 from redis import client
-import six
 
 try:
     _Pipeline = client.BasePipeline
@@ -24,7 +21,7 @@ except AttributeError:
     #redis-python client 3.0+ change
     _Pipeline = client.Pipeline
 
-from .columns import (Column, IndexOnly, Text, PrimaryKey, ManyToOne, OneToOne,
+from .columns import (Column, IndexOnly, PrimaryKey, ManyToOne, OneToOne,
     OneToMany, MODELS, MODELS_REFERENCED, _on_delete, SKIP_ON_DELETE, UnsafeColumn)
 from .exceptions import (ORMError, UniqueKeyViolation, InvalidOperation,
     QueryError, ColumnError, InvalidColumnValue, DataRaceError,
@@ -38,7 +35,7 @@ from .util import (ClassProperty, _connect, session,
 _skip = None
 _skip = set(globals()) - set(['__doc__'])
 
-_STRING_SORT_KEYGENS = [ss.__name__ for ss in STRING_SORT_KEYGENS]
+_STRING_SORT_KEYGENS = frozenset(ss.__name__ for ss in STRING_SORT_KEYGENS)
 
 def _conn_needs_decoding(conn):
     if isinstance(conn.connection_pool.connection_kwargs, dict):
@@ -48,7 +45,7 @@ def _conn_needs_decoding(conn):
 class _ModelMetaclass(type):
     def __new__(cls, name, bases, dict):
         ns = dict.pop('_namespace', None)
-        if ns and not isinstance(ns, six.string_types):
+        if ns and not isinstance(ns, str):
             raise ORMError("The _namespace attribute must be a string, not %s"%type(ns))
         dict['_namespace'] = ns or name
         if name in MODELS or dict['_namespace'] in MODELS:
@@ -148,7 +145,7 @@ class _ModelMetaclass(type):
                     raise ColumnError("Foreign model OneToMany attribute %s.%s missing column argument"%(t, _a))
 
         # handle multi-column uniqueness constraints
-        if composite_unique and isinstance(composite_unique[0], six.string_types):
+        if composite_unique and isinstance(composite_unique[0], str):
             composite_unique = [composite_unique]
 
         seen = {}
@@ -173,6 +170,10 @@ class _ModelMetaclass(type):
 
         dict['_pkey'] = pkey
         dict['_gindex'] = GeneralIndex(dict['_namespace'])
+        # (attr, column) pairs initialized by Model.__init__, computed once
+        # here instead of on every entity creation
+        dict['_init_columns'] = tuple((attr, col) for attr, col in columns.items()
+            if not isinstance(col, UnsafeColumn))
         for cols in many_to_one.values():
             for attr, col in cols:
                 MODELS_REFERENCED.setdefault(col._ftable, []).append((dict['_namespace'], attr, col._on_delete))
@@ -199,7 +200,7 @@ def _as_bytes(data):
         return data.encode("latin-1")
     return str(data).encode("latin-1")
 
-class Model(six.with_metaclass(_ModelMetaclass, object)):
+class Model(metaclass=_ModelMetaclass):
     '''
     This is the base class for all models. You subclass from this base Model
     in order to create a model with columns. As an example::
@@ -268,22 +269,20 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
         self._modified = False
         self._deleted = False
         self._init = False
-        for attr in self._columns:
-            if isinstance(self._columns[attr], UnsafeColumn):
-                continue
-
+        pkey = self._pkey
+        last = self._last
+        for attr, col in self._init_columns:
             cval = kwargs.get(attr, None)
             if loading and cval is False:
                 # Weird Redis' JSON nil -> False thing
                 cval = None
-            if self._new and attr == self._pkey and cval:
+            if not loading and attr == pkey and cval:
                 raise InvalidColumnValue("Cannot pass primary key on object creation")
-            data = (model, attr, cval, not self._new)
-            setattr(self, attr, data)
+            setattr(self, attr, (model, attr, cval, loading))
             if cval != None:
-                if not isinstance(cval, six.string_types):
-                    cval = self._columns[attr]._to_redis(cval)
-                self._last[attr] = cval
+                if not isinstance(cval, str):
+                    cval = col._to_redis(cval)
+                last[attr] = cval
 
         if use_session and self._new and not extra_ok:
             delta = set(kwargs) - set(self._columns)
@@ -326,7 +325,7 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
 
         conn = _connect(self)
         data = conn.hgetall(self._pk)
-        if six.PY3 and _conn_needs_decoding(conn):
+        if _conn_needs_decoding(conn):
             data = dict((k.decode(), v.decode()) for k, v in data.items())
         self.__init__(_loading=True, **data)
 
@@ -394,13 +393,7 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
 
                     if ca._suffix:
                         for k in generated:
-                            if six.PY2 and isinstance(k, str) and isinstance(ca, Text):
-                                try:
-                                    suffix.append([attr, k.decode('utf-8')[::-1].encode('utf-8')])
-                                except UnicodeDecodeError:
-                                    suffix.append([attr, k[::-1]])
-                            else:
-                                suffix.append([attr, k[::-1]])
+                            suffix.append([attr, k[::-1]])
 
                 elif isinstance(generated, dict):
                     if ca._index:
@@ -424,13 +417,7 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
                             warnings.warn("Prefix indexes are currently not enabled for non-standard keygen functions", stacklevel=2)
                         else:
                             ex = (lambda x:x) if ca._keygen.__name__ in ('SIMPLE', 'IDENTITY') else (lambda x:x.lower())
-                            if six.PY2 and isinstance(nval, str) and isinstance(ca, Text):
-                                try:
-                                    suffix.append([attr, ex(nval.decode('utf-8')[::-1]).encode('utf-8')])
-                                except UnicodeDecodeError:
-                                    suffix.append([attr, ex(nval[::-1])])
-                            else:
-                                suffix.append([attr, ex(nval[::-1])])
+                            suffix.append([attr, ex(nval[::-1])])
 
                 else:
                     raise ColumnError("Don't know how to turn %r into a sequence of keys"%(generated,))
@@ -501,11 +488,12 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
 
         id_only = str(pk)
         old_data = [] if is_new else ([(cls._pkey, str(pk))] + [(k, old.get(k)) for k in data if k in old])
-        redis_writer_lua(conn, cls._pkey, model, id_only, unique, udeleted,
-            deleted, data, list(keys), scores, prefix, suffix, geo, old_data,
-            delete, list(keys_to_delete))
+        # only returns a result checker when writing through a pipeline
+        check = redis_writer_lua(conn, cls._pkey, model, id_only, unique,
+            udeleted, deleted, data, list(keys), scores, prefix, suffix, geo,
+            old_data, delete, list(keys_to_delete))
 
-        return changes, redis_data
+        return changes, redis_data, check
 
     def to_dict(self):
         '''
@@ -522,6 +510,25 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
 
         If the underlying entity was deleted and you want to re-save the entity,
         you can pass ``force=True`` to force a full re-save of the entity.
+
+        Inside a ``with session.autopipe():`` block, the save is deferred until
+        the end of the block, and this returns ``None``.
+        '''
+        deferred = session.autopiped
+        if deferred is not None and not self._deleted:
+            key = id(self)
+            if key in deferred:
+                _, pfull, pforce = deferred[key]
+                full, force = full or pfull, force or pforce
+            deferred[key] = (self, full, force)
+            return None
+        return self._save(full, force)()
+
+    def _save(self, full=False, force=False, _conn=None):
+        '''
+        Writes the entity, returning a callable that finishes the save. When
+        writing through a pipeline, that callable must be passed this entity's
+        result from the pipeline after it is executed.
         '''
         # handle the pre-commit hooks
         was_new = self._new
@@ -531,18 +538,24 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
             self._before_update()
 
         new = self.to_dict()
-        ret, data = self._apply_changes(
-            self._last, new, full or self._new or force, is_new=self._new or force)
-        self._last = data
-        self._new = False
-        self._modified = False
-        self._deleted = False
-        # handle the post-commit hooks
-        if was_new:
-            self._after_insert()
-        else:
-            self._after_update()
-        return ret
+        ret, data, check = self._apply_changes(
+            self._last, new, full or self._new or force, is_new=self._new or force,
+            _conn=_conn)
+
+        def finish(result=None):
+            if check is not None:
+                check(result)
+            self._last = data
+            self._new = False
+            self._modified = False
+            self._deleted = False
+            # handle the post-commit hooks
+            if was_new:
+                self._after_insert()
+            else:
+                self._after_update()
+            return ret
+        return finish
 
     def delete(self, **kwargs):
         '''
@@ -583,12 +596,12 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
             MyModel.get(5)
             MyModel.get([1, 6, 2, 4])
 
-        Passing a list or a tuple will return multiple entities, in the same
-        order that the ids were passed.
+        Passing a list, tuple, or range will return multiple entities, in the
+        same order that the ids were passed.
         '''
         conn = _connect(cls)
         # prepare the ids
-        single = not isinstance(ids, (list, tuple, set, frozenset))
+        single = not isinstance(ids, (list, tuple, set, frozenset, range))
         if single:
             ids = [ids]
         pks = ['%s:%s'%(cls._namespace, id) for id in map(int, ids)]
@@ -606,7 +619,7 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
             # Update output list
             for i, data in zip(idxs, pipe.execute()):
                 if data:
-                    if six.PY3 and _conn_needs_decoding(conn):
+                    if _conn_needs_decoding(conn):
                         data = dict((k.decode(), v.decode()) for k, v in data.items())
                     out[i] = cls(_loading=True, **data)
             # Get rid of missing models
@@ -654,7 +667,7 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
         _limit = kwargs.pop('_limit', ())
         if _limit and len(_limit) != 2:
             raise QueryError("Limit must include both 'offset' and 'count' parameters")
-        elif _limit and not all(isinstance(x, six.integer_types) for x in _limit):
+        elif _limit and not all(isinstance(x, int) for x in _limit):
             raise QueryError("Limit arguments must both be integers")
         if len(kwargs) != 1:
             raise QueryError("We can only fetch object(s) by exactly one attribute, you provided %s"%(len(kwargs),))
@@ -734,7 +747,7 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
         idx = cls._namespace + ":" + attr + ":pre"
         val = []
         for v in values:
-            if isinstance(v, six.string_types):
+            if isinstance(v, str):
                 v = v.encode("utf-8")
             val.append(v)
 
@@ -766,7 +779,7 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
         idx = cls._namespace + ":" + attr + ":suf"
         val = []
         for v in values:
-            if isinstance(v, six.string_types):
+            if isinstance(v, str):
                 v = v[::-1].encode("utf-8")
             else:
                 v = v[::-1]
@@ -919,9 +932,10 @@ class Model(six.with_metaclass(_ModelMetaclass, object)):
             txn_model.refresh()
 
         if refresh_index:
-            self.save(True)
-            other.save(True)
-            txn_model.save(True)
+            # written now, even inside session.autopipe()
+            self._save(True)()
+            other._save(True)()
+            txn_model._save(True)()
 
         return 
 
@@ -1153,8 +1167,6 @@ return cjson.encode({changes=#nkeys + #nscored + #nprefix + #nsuffix + #ngeo + _
 ''')
 
 def _fix_bytes(d):
-    if six.PY2:
-        raise TypeError
     if isinstance(d, bytes):
         return d.decode('latin-1')
     raise TypeError
@@ -1185,11 +1197,16 @@ def redis_writer_lua(conn, pkey, namespace, id, unique, udelete, delete,
 
     if isinstance(conn, _Pipeline):
         # we're in a pipelined write situation, don't parse the pipeline :P
-        return
+        # but let the caller check the result after the pipeline executes
+        return lambda result: _check_writer_result(
+            result, pkey, namespace, id, unique)
+
+    _check_writer_result(result, pkey, namespace, id, unique)
 
-    if six.PY3 and sys.version_info < (3, 6):
-        # necessary for old Pythons
-        result = result.decode()
+def _check_writer_result(result, pkey, namespace, id, unique):
+    if isinstance(result, Exception):
+        # pipelined writes hand us errors instead of raising them
+        raise result
 
     result = json.loads(result)
     if 'unique' in result:
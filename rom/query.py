@@ -15,8 +15,6 @@ import json
 import warnings
 import uuid
 
-import six
-
 from .exceptions import QueryError
 from .index import Geofilter, Pattern, Prefix, Suffix, _ts
 from .util import (_connect, session, dt2ts, t2ts, _script_load,
@@ -25,10 +23,10 @@ from .util import (_connect, session, dt2ts, t2ts, _script_load,
 _skip = None
 _skip = set(globals()) - set(['__doc__'])
 
-NUMERIC_TYPES = six.integer_types + (float, _Decimal, datetime, date, dtime)
+NUMERIC_TYPES = (int, float, _Decimal, datetime, date, dtime)
 
 NOT_NULL = (None, None)
-_STRING_SORT_KEYGENS = [ss.__name__ for ss in STRING_SORT_KEYGENS]
+_STRING_SORT_KEYGENS = frozenset(ss.__name__ for ss in STRING_SORT_KEYGENS)
 ALLOWED_DIST = ('m', 'km', 'mi', 'ft')
 
 def _dict_data_factory(columns):
@@ -57,7 +55,7 @@ def _list_data_factory(columns):
         return data
     return make
 
-_LT = six.string_types + (six.binary_type,)
+_LT = (str, bytes)
 
 class Query(object):
     '''
@@ -253,10 +251,10 @@ class Query(object):
                 # for simple numeric equality filters
                 value = (value, value)
 
-            if isinstance(value, six.string_types):
+            if isinstance(value, str):
                 cur_filters.append('%s:%s'%(attr, value))
 
-            elif six.PY3 and isinstance(value, bytes):
+            elif isinstance(value, bytes):
                 cur_filters.append('%s:%s'%(attr, value.decode('latin-1')))
 
             elif isinstance(value, tuple):
@@ -445,8 +443,6 @@ class Query(object):
         if not self._filters and not self._order_by:
             if self._model._columns[self._model._pkey]._index:
                 return self._iter_all_pkey()
-            conn = _connect(self._model)
-            version = list(map(int, conn.info()['redis_version'].split('.')[:2]))
             return self._iter_all()
         return self._iter_results(timeout, pagesize)
 
@@ -596,7 +592,7 @@ class Query(object):
         Usage::
 
             ukey = User.query.endswith(email='@gmail.com').cached_result(30)
-            for i in xrange(0, conn.zcard(ukey), 100):
+            for i in range(0, conn.zcard(ukey), 100):
                 # refresh the expiration
                 conn.expire(ukey, 30)
                 users = User.get(conn.zrange(ukey, i, i+99))
@@ -616,7 +612,23 @@ class Query(object):
         filters, ordered by the specified ordering (if any), limited by any
         earlier limit calls.
         '''
-        return list(self)
+        if self._select or not (self._filters or self._order_by):
+            return list(self)
+
+        # Search and fetch in one pass, rather than paging through a cached
+        # result ZSET like iter_result() does
+        offset, count = self._limit or (0, None)
+        if count is not None and count <= 0:
+            return []
+        ids = self._model._gindex.search(
+            _connect(self._model), self._filters, self._order_by, max(offset, 0), count)
+        # Same session comment as from _iter_results()
+        isk = set(session.known.keys())
+        out = self._model.get(ids)
+        for ent in out:
+            if ent._pk not in isk:
+                session.forget(ent)
+        return out
 
     def all(self):
         '''
@@ -624,6 +636,50 @@ class Query(object):
         '''
         return self.execute()
 
+    def ids(self):
+        '''
+        Returns the primary keys of the entities that match the filters,
+        ordered and limited like ``execute()``, without fetching the entities
+        themselves::
+
+            # ids of the most recent 25 users
+            User.query.order_by('-created_at').limit(0, 25).ids()
+
+        Without filters or ordering, returns the ids of all entities in id
+        order, using the primary key index if there is one.
+        '''
+        offset, count = self._limit or (0, None)
+        if count is not None and count <= 0:
+            return []
+        offset = max(offset, 0)
+        if self._filters or self._order_by:
+            ids = self._model._gindex.search(
+                _connect(self._model), self._filters, self._order_by, offset, count)
+        elif self._model._columns[self._model._pkey]._index:
+            index = '%s:%s:idx'%(self._model._namespace, self._model._pkey)
+            end = -1 if count is None else offset + count - 1
+            ids = _connect(self._model).zrange(index, offset, end)
+        else:
+            ids = self._all_ids(offset, count)
+        return list(map(int, ids))
+
+    def _all_ids(self, offset, count):
+        # Like _iter_all(), but only checks which ids still exist
+        conn = _connect(self._model)
+        prefix = '%s:'%self._model._namespace
+        max_id = int(conn.get('%s%s:'%(prefix, self._model._pkey)) or '0')
+        wanted = None if count is None else offset + count
+        ids = []
+        for i in range(1, max_id + 1, 100):
+            block = range(i, min(i + 100, max_id + 1))
+            pipe = conn.pipeline(False)
+            for id in block:
+                pipe.exists(prefix + str(id))
+            ids.extend(id for id, exists in zip(block, pipe.execute()) if exists)
+            if wanted is not None and len(ids) >= wanted:
+                break
+        return ids[offset:wanted]
+
     def first(self):
         '''
         Returns only the first result from the query, if any.
@@ -703,7 +759,7 @@ def _select_generator(lst, model, cols, decode, remove_last, factory):
             data = yield final([None if c is False else c for c in islice(data, wanted)])
 
 def _json_loads(data):
-    if six.PY3 and isinstance(data, six.binary_type):
+    if isinstance(data, bytes):
         data = data.decode('utf-8')
     return json.loads(data)
 
@@ -20,6 +20,15 @@ There are four ways to change the way that ``rom`` connects to Redis.
 
     rom.util.set_connection_settings(host='myhost', db=7)
 
+   The default connection (configured by the ``ROM_REDIS_URI`` environment
+   variable) uses a blocking pool of up to ``ROM_POOL_SIZE`` connections
+   (default 32) shared by all threads, waiting up to ``ROM_POOL_TIMEOUT``
+   seconds (default 20) for a free connection. If you have more threads that
+   use Redis concurrently, raise ``ROM_POOL_SIZE``, or pass
+   ``max_connections`` to ``set_connection_settings()``. Waiters of
+   ``Lock(..., pubsub=True)`` each hold a connection while they wait, so count
+   them as threads.
+
 2. Give each model its own Redis connection on creation, called _conn, which
    will be used whenever any Redis-related calls are made on instances of that
    model::
@@ -134,33 +143,35 @@ per model.::
 
 '''
 
-from __future__ import print_function
 from collections import deque
 from datetime import datetime, date, time as dtime
+from decimal import Decimal as _Decimal
 from hashlib import sha1
 from itertools import chain
 import math
 import os
+import random
 import string
+import struct
 import threading
 import time
 import weakref
 import warnings
 
 import redis
-import six
 
 from .exceptions import DataRaceError, ORMError
 
-if six.PY3:
-    import binascii
-
 _skip = None
 _skip = set(globals()) - set(['__doc__'])
 
+POOL_SIZE = int(os.environ.get('ROM_POOL_SIZE', '32'))
+POOL_TIMEOUT = float(os.environ.get('ROM_POOL_TIMEOUT', '20'))
+
 if redis.VERSION >= (2, 8):
     REDIS_URI = os.environ.get('ROM_REDIS_URI', 'redis://localhost:6379/0')
-    CONNECTION = redis.Redis.from_url(REDIS_URI)
+    CONNECTION = redis.Redis(connection_pool=redis.BlockingConnectionPool.from_url(
+        REDIS_URI, max_connections=POOL_SIZE, timeout=POOL_TIMEOUT))
 else:
     CONNECTION = redis.Redis()
 
@@ -168,8 +179,33 @@ def set_connection_settings(*args, **kwargs):
     '''
     Update the global connection settings for models that don't have
     model-specific connections.
+
+    Like the default connection, threads share a bounded, blocking pool of
+    ``max_connections`` connections (default ``POOL_SIZE``), waiting up to
+    ``pool_timeout`` seconds (default ``POOL_TIMEOUT``) for a connection to be
+    available. Pass ``max_connections=None`` for redis-py's default unbounded
+    pool, or your own ``connection_pool``.
+
+    .. note:: every ``Lock(..., pubsub=True)`` waiter holds one of these
+        connections while it waits, so with the default pool of 32, 32
+        waiters leave nothing for anyone else, and unrelated calls wait up to
+        ``pool_timeout`` seconds before raising ``ConnectionError``. Size the
+        pool for your waiters, or give pubsub locks their own connection.
     '''
     global CONNECTION
+    max_connections = kwargs.pop('max_connections', POOL_SIZE)
+    pool_timeout = kwargs.pop('pool_timeout', POOL_TIMEOUT)
+    if max_connections and 'connection_pool' not in kwargs:
+        # let redis-py turn our arguments into connection settings (its pool
+        # doesn't connect until used), then use those for our own pool
+        single = kwargs.pop('single_connection_client', False)
+        settings = redis.Redis(*args, **kwargs).connection_pool
+        args = ()
+        kwargs = {'single_connection_client': single,
+            'connection_pool': redis.BlockingConnectionPool(
+                max_connections=max_connections, timeout=pool_timeout,
+                connection_class=settings.connection_class,
+                **settings.connection_kwargs)}
     CONNECTION = redis.Redis(*args, **kwargs)
 
 def get_connection():
@@ -178,24 +214,44 @@ def get_connection():
     '''
     return CONNECTION
 
+_MODEL = None
 def _connect(obj):
     '''
     Tries to get the _conn attribute from a model. Barring that, gets the
     global default connection using other methods.
     '''
-    from .columns import MODELS
-    if isinstance(obj, MODELS['Model']):
+    global _MODEL
+    if _MODEL is None:
+        # can't import at module load, columns/model import from here
+        from .columns import MODELS
+        _MODEL = MODELS['Model']
+    if isinstance(obj, _MODEL):
         obj = obj.__class__
-    if hasattr(obj, '_conn'):
-        return obj._conn
-    if hasattr(obj, 'CONN'):
-        return obj.CONN
-    return get_connection()
+    conn = getattr(obj, '_conn', None)
+    if conn is None:
+        conn = getattr(obj, 'CONN', None)
+    return get_connection() if conn is None else conn
+
+# [major, minor] server versions by connection pool id, tracked like the pools
+# that _script_load() has sent each script over
+_VERSIONS = {}
+def _redis_version(conn):
+    '''
+    Returns the ``[major, minor]`` version of the Redis server behind *conn*,
+    fetched with INFO only once per connection pool.
+    '''
+    pool = id(getattr(conn, 'connection_pool', conn))
+    version = _VERSIONS.get(pool)
+    if version is None:
+        info = conn.info('server')
+        version = _VERSIONS[pool] = list(map(int, info['redis_version'].split('.')[:2]))
+    return version
 
 class ClassProperty(object):
     '''
     Borrowed from: https://gist.github.com/josiahcarlson/1561563
     '''
+    __slots__ = 'get', 'set', 'delete'
     def __init__(self, get, set=None, delete=None):
         self.get = get
         self.set = set
@@ -239,18 +295,86 @@ class ClassProperty(object):
 # vs.
 # results = Model.query.filter(**{'col:ex':(start, end)}).execute()
 
+def _datetime_score(val):
+    # dt2ts() only has microsecond resolution, so 6 places round-trip
+    return '%.6f'%dt2ts(val)
+
+def _date_score(val):
+    # plain dates are always whole seconds
+    return str((val.toordinal() - _epocho) * 86400)
+
+def _time_score(val):
+    return repr(t2ts(val))
+
+# score formatting by exact type; datetime is listed before its base class
+_NUMERIC_FORMAT = {
+    int: str,
+    bool: str,
+    float: repr,
+    _Decimal: str,
+    datetime: _datetime_score,
+    date: _date_score,
+    dtime: _time_score,
+}
+
+def _numeric_format(typ):
+    # The first value of an unlisted type (like an IntEnum member) uses the
+    # format of its first listed base class, and is listed from then on.
+    for base, fmt in list(_NUMERIC_FORMAT.items()):
+        if issubclass(typ, base):
+            break
+    else:
+        fmt = str
+    _NUMERIC_FORMAT[typ] = fmt
+    return fmt
+
 def _numeric_keygen(val):
     if val is None:
         return None
-    if isinstance(val, (datetime, date)):
-        val = dt2ts(val)
-    elif isinstance(val, dtime):
-        val = t2ts(val)
-    return {'': repr(val) if isinstance(val, float) else str(val)}
+    typ = type(val)
+    return {'': (_NUMERIC_FORMAT.get(typ) or _numeric_format(typ))(val)}
+
+def _str_numeric_keygen(val):
+    if val is None:
+        return None
+    return {'': str(val)}
+
+def _float_keygen(val):
+    if val is None:
+        return None
+    return {'': repr(val)}
+
+def _date_keygen(val):
+    if val is None:
+        return None
+    if isinstance(val, datetime):
+        return {'': _datetime_score(val)}
+    return {'': _date_score(val)}
+
+def _time_keygen(val):
+    if val is None:
+        return None
+    return {'': _time_score(val)}
+
+def _make_numeric_keygen(allowed):
+    '''
+    Returns a version of ``_numeric_keygen`` specialized for the value types
+    allowed by a column, so that type checks are done once when the column is
+    defined instead of on every indexed write. Falls back to the generic
+    ``_numeric_keygen`` for columns that allow mixed types (like ``Float``).
+    '''
+    allowed = (allowed,) if isinstance(allowed, type) else tuple(allowed)
+    for types, keygen in ((date, _date_keygen), (dtime, _time_keygen),
+            (float, _float_keygen), ((int, _Decimal), _str_numeric_keygen)):
+        if allowed and all(issubclass(t, types) for t in allowed):
+            return keygen
+    return _numeric_keygen
 
 def _boolean_keygen(val):
     return [str(bool(val))]
 
+_PUNCTUATION = string.punctuation
+
 def FULL_TEXT(val):
     '''
     This is a basic full-text index keygen function. Words are lowercased, split
@@ -261,15 +385,17 @@ def FULL_TEXT(val):
         val = repr(val)
     elif val in (None, ''):
         return None
-    elif not isinstance(val, six.string_types):
-        if six.PY3 and isinstance(val, bytes):
+    elif not isinstance(val, str):
+        if isinstance(val, bytes):
             val = val.decode('latin-1')
         else:
             val = str(val)
-    r = sorted(set([x for x in [s.lower().strip(string.punctuation) for s in val.split()] if x]))
-    if not isinstance(val, str):  # unicode on py2k
-        return [s.encode('utf-8') for s in r]
-    return r
+    # lowercase the whole string once, and only strip each distinct word;
+    # str.translate() would also drop inner punctuation ("e-mail" -> "email"),
+    # changing the terms of existing indexes, and isn't faster
+    words = {s.strip(_PUNCTUATION) for s in set(val.lower().split())}
+    words.discard('')
+    return sorted(words)
 
 # For compatability with the rest of the package, as well as those who are
 # explicitly using this keygen as part of query calculation.
@@ -290,8 +416,8 @@ def SIMPLE(val):
     '''
     if not val:
         return None
-    if not isinstance(val, six.string_types):
-        if six.PY3 and isinstance(val, bytes):
+    if not isinstance(val, str):
+        if isinstance(val, bytes):
             val = val.decode('latin-1')
         else:
             val = str(val)
@@ -324,7 +450,7 @@ def IDENTITY(val):
     '''
     if not val:
         return None
-    if not isinstance(val, six.string_types_ex):
+    if not isinstance(val, (str, bytes)):
         val = str(val)
     return [val]
 
@@ -341,7 +467,7 @@ def IDENTITY_STRING(val):
     like IDENTITY, but for String columns
     """
     if val:
-        if not isinstance(val, six.binary_type):
+        if not isinstance(val, bytes):
             val = val.encode("latin-1")
         return [val]
 
@@ -351,7 +477,7 @@ def IDENTITY_STRING_CI(val):
     like IDENTITY_CI, but for String columns
     """
     if val:
-        if not isinstance(val, six.binary_type):
+        if not isinstance(val, bytes):
             val = val.encode("latin-1")
         return [val.lower()]
 
@@ -363,49 +489,61 @@ STRING_SORT_KEYGENS_STR = ', '.join(x.__name__ for x in STRING_SORT_KEYGENS)
 
 def _many_to_one_keygen(val):
     if val is None:
-        return []
-    if hasattr(val, '_data') and hasattr(val, '_pkey'):
-        return {'': val._data[val._pkey]}
+        # shared and immutable, callers only check for an empty result
+        return ()
+    data = getattr(val, '_data', None)
+    if data is not None and hasattr(val, '_pkey'):
+        return {'': data[val._pkey]}
     return {'': val.id}
 
 def _to_score(v, s=False):
-    v = repr(v) if isinstance(v, float) else str(v)
-    if s:
-        if v[:1] != '(':
-            return '(' + v
+    if isinstance(v, float):
+        v = repr(v)
+    elif not isinstance(v, str):
+        v = str(v)
+    if v[:1] != '(':
+        # the usual case, nothing to strip
+        return '(' + v if s else v
     return v.lstrip('(')
 
 # borrowed and modified from:
 # https://gist.github.com/josiahcarlson/8459874
+_DOUBLE = struct.Struct('>d')
+_UINT64 = struct.Struct('>Q')
 def _bigint_to_float(v):
-    assert isinstance(v, six.integer_types)
-    sign = -1 if v < 0 else 1
-    v *= sign
+    # The old (2**52 + mantissa) * 2.0**(exponent-52-1022) calculation is the
+    # same as treating v + 2**52 as the bits of an IEEE 754 double, with the
+    # sign in the top bit.
+    assert isinstance(v, int)
+    sign = 0
+    if v < 0:
+        sign = 0x8000000000000000
+        v = -v
     assert v < 0x7fe0000000000000
-    exponent, mantissa = divmod(v, 2**52)
-    return sign * (2**52 + mantissa) * 2.0**(exponent-52-1022)
+    return _DOUBLE.unpack(_UINT64.pack((v + 0x10000000000000) | sign))[0]
 
+_POW258 = [258 ** i for i in range(8)]
 def _prefix_score(v, next=False):
-    if isinstance(v, six.text_type):
+    if isinstance(v, str):
         v = v.encode('utf-8')
     # We only get 7 characters of score-based prefix.
+    v = v[:7]
     score = 0
-    for ch in six.iterbytes(v[:7]):
-        score *= 258
-        score += ch + 1
+    for ch in v:
+        score = score * 258 + ch + 1
     if next:
         score += 1
-    score *= 258 ** max(0, 7-len(v))
-    return repr(_bigint_to_float(score))
+    return repr(_bigint_to_float(score * _POW258[7 - len(v)]))
 
 _epoch = datetime(1970, 1, 1)
 _epochd = _epoch.date()
+_epocho = _epochd.toordinal()
 def dt2ts(value):
     if isinstance(value, datetime):
         delta = value - _epoch
-    else:
-        delta = value - _epochd
-    return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.
+        return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.
+    # plain dates don't need a timedelta, but still need to be floats
+    return float((value.toordinal() - _epocho) * 86400)
 
 def ts2dt(value):
     return datetime.utcfromtimestamp(value)
@@ -419,18 +557,15 @@ def ts2t(value):
     second, value = divmod(value, 1)
     return dtime(*map(int, [hour, minute, second, value*1000000]))
 
+def _encode_unique_column(col):
+    if not col:
+        return b'\0\0'
+    if not isinstance(col, bytes):
+        col = (col if isinstance(col, str) else str(col)).encode('utf-8')
+    return b'\0\0' + col
+
 def _encode_unique_constraint(data):
-    cleaned = []
-    for col in data:
-        col = (col or b'')
-        if not isinstance(col, (six.text_type, six.binary_type)):
-            col = six.text_type(col)
-        if isinstance(col, six.text_type):
-            col = col.encode('utf-8')
-        cleaned.append(b'\0\0' + col)
-
-    ret = b'\0'.join(cleaned)
-    return ret if six.PY2 else ret.decode('latin-1')
+    return b'\0'.join(map(_encode_unique_column, data)).decode('latin-1')
 
 NULL_SESSION = False
 
@@ -444,19 +579,28 @@ class Session(threading.local):
     when you ``import rom`` as ``rom.session``.
 
     .. note:: calling ``.flush()`` or ``.commit()`` doesn't cause all objects
-        to be written simultaneously. They are written one-by-one, with any
-        error causing the call to fail.
+        to be written simultaneously. They are pipelined, but written
+        one-by-one, with any error causing the call to fail after the other
+        objects are written.
     '''
     def __init__(self, *args, **kwargs):
+        # threading.local calls __init__ again the first time this object is
+        # used from any other thread, so every thread gets its own containers
+        # here, and the rest of the methods don't need to check for them.
         threading.local.__init__(self, *args, **kwargs)
-        self._init()
-
-    def _init(self):
-        try:
-            self.known
-        except AttributeError:
-            self.known = {}
-            self.wknown = weakref.WeakValueDictionary()
+        # known holds strong references to entities that can be saved on
+        # flush/commit, and is the only structure we iterate over. wknown is
+        # only used for pk lookups in .get(), and is only filled in by
+        # .commit(), so entities survive for as long as something else
+        # references them. dirty holds the entities that were modified when
+        # they were added, so .flush() only needs to look at those.
+        self.known = {}
+        self.wknown = weakref.WeakValueDictionary()
+        self.dirty = {}
+        # entities whose .save() was deferred by .autopipe(), and the locks
+        # that need to be released after they are written
+        self.autopiped = None
+        self.autopiped_locks = None
 
     @property
     def null_session(self):
@@ -475,13 +619,14 @@ class Session(threading.local):
         '''
         Adds an entity to the session.
         '''
-        if self.null_session:
+        # skip the property, this is called for every entity we create or load
+        if getattr(self, '_null_session', NULL_SESSION):
             return
-        self._init()
         pk = obj._pk
         if not pk.endswith(':None'):
             self.known[pk] = obj
-            self.wknown[pk] = obj
+            if obj._modified:
+                self.dirty[pk] = obj
 
     def forget(self, obj):
         '''
@@ -489,15 +634,14 @@ class Session(threading.local):
         deleted). Call this to ensure that an entity that you've modified is
         not automatically saved on ``session.commit()`` .
         '''
-        self._init()
         self.known.pop(obj._pk, None)
         self.wknown.pop(obj._pk, None)
+        self.dirty.pop(obj._pk, None)
 
     def get(self, pk):
         '''
         Fetches an entity from the session based on primary key.
         '''
-        self._init()
         return self.known.get(pk) or self.wknown.get(pk)
 
     def rollback(self):
@@ -505,8 +649,12 @@ class Session(threading.local):
         Forget about all entities in the session (``.commit()`` will do
         nothing).
         '''
+        if not (self.known or self.dirty or self.wknown):
+            # already clean, keep the existing containers
+            return
         self.wknown = weakref.WeakValueDictionary()
         self.known = {}
+        self.dirty = {}
 
     def flush(self, full=False, all=False, force=False):
         '''
@@ -516,9 +664,41 @@ class Session(threading.local):
 
         See the ``.commit()`` method for arguments and their meanings.
         '''
-        self._init()
-
-        return self.save(*self.known.values(), full=full, all=all, force=force)
+        objects = self.known if all else self.dirty
+        self.dirty = {}
+        try:
+            return self.save(*objects.values(), full=full, all=all, force=force)
+        finally:
+            # anything that failed to save is still dirty
+            for pk, obj in objects.items():
+                if obj._modified and not obj._deleted:
+                    self.dirty.setdefault(pk, obj)
+
+    def autopipe(self):
+        '''
+        Returns a context manager that defers all ``Model.save()`` calls in
+        this thread until the end of the ``with`` block, then writes those
+        entities in one pipelined batch::
+
+            with rom.session.autopipe():
+                for user in users:
+                    user.visits += 1
+                    user.save()
+
+        Deferred ``.save()`` calls return ``None``. Errors (like unique
+        violations) are raised when the block exits, after every deferred
+        entity that can be written has been written.
+
+        If the block raises an exception, the deferred entities are not
+        written, but they are still modified and in the session, so a later
+        ``.flush()`` or ``.commit()`` will write them; call ``.rollback()``
+        (or ``.forget()`` them) if you don't want that.
+
+        Locks released by leaving their own ``with`` block inside this block
+        stay held until the deferred entities are written, then are released
+        together.
+        '''
+        return _AutoPipe(self)
 
     def commit(self, full=False, all=False, force=False):
         '''
@@ -536,9 +716,23 @@ class Session(threading.local):
               DataRaceError and EntityDeletedError exceptions
         '''
         changes = self.flush(full, all, force)
+        self.wknown.update(self.known)
         self.known = {}
         return changes
 
+    def reset(self, full=False, all=False, force=False):
+        '''
+        Call ``.save()`` on all modified entities in the session, then forget
+        all entities in the session. The same as calling ``.commit()``
+        followed by ``.rollback()``, without moving known entities into the
+        weak cache only to discard them.
+
+        See the ``.commit()`` method for arguments and their meanings.
+        '''
+        changes = self.flush(full, all, force)
+        self.rollback()
+        return changes
+
     def save(self, *objects, **kwargs):
         '''
         This method is an alternate API for saving many entities (possibly not
@@ -552,27 +746,70 @@ class Session(threading.local):
 
         You can pass the keyword arguments ``full``, ``all``, and ``force`` with
         the same meaning and semantics as the ``.commit()`` method.
+
+        Writes are pipelined, one round trip per Redis server. Entities passed
+        more than once are written once. Entities of models that override
+        ``.save()`` are saved by calling that method, in its own round trip.
+        If any entity fails to save (because of a unique or data race
+        violation, or an exception from a hook), the others are still written,
+        and the first exception is raised after all writes are done.
         '''
         from rom import Model
         full = kwargs.get('full')
         all = kwargs.get('all')
         force = kwargs.get('force')
+        c2p = {}
+        finish = []
+        seen = set()
         changes = 0
-        items = deque()
-        items.extend(objects)
+        error = None
+        # a reversed stack, so we pop entities in the order they were passed
+        items = list(reversed(objects))
         while items:
-            o = items.popleft()
-            if isinstance(o, (list, tuple)):
-                items.extendleft(reversed(o))
-            elif isinstance(o, Model):
-                if not o._deleted and (all or o._modified):
-                    changes += o.save(full, force)
+            o = items.pop()
+            # entities are the common case, check for them first
+            if isinstance(o, Model):
+                if id(o) in seen:
+                    # written once, or a second write would race the first
+                    continue
+                seen.add(id(o))
+                if o._deleted or not (all or o._modified):
+                    continue
+                if type(o).save is not Model.save:
+                    # respect overridden .save() methods, at the cost of a
+                    # round trip each
+                    try:
+                        changes += o.save(full, force) or 0
+                    except Exception as err:
+                        error = error or err
+                    continue
+                c = o._connection
+                if c not in c2p:
+                    c2p[c] = c.pipeline(False)
+                finish.append((c, o._save(full, force, _conn=c2p[c])))
+
+            elif isinstance(o, (list, tuple)):
+                items.extend(reversed(o))
 
             else:
                 raise ORMError(
                     "Cannot save an object that is not an instance of a Model (you provided %r)"%(
                         o,))
 
+        # actually write the data to Redis
+        results = {c: iter(_execute_pipeline(p)) for c, p in c2p.items()}
+
+        for c, f in finish:
+            # pipelines return results in the order that entities were written,
+            # and every entity was written, so every one needs to be finished
+            result = next(results[c])
+            try:
+                changes += f(result)
+            except Exception as err:
+                error = error or err
+
+        if error is not None:
+            raise error
         return changes
 
     def delete(self, *objects, **kwargs):
@@ -636,7 +873,7 @@ class Session(threading.local):
 
         # actually delete the data in Redis
         for p in c2p.values():
-            p.execute()
+            _execute_transaction(p)
 
         # remove the objects from the session
         forget = self.forget
@@ -659,7 +896,6 @@ class Session(threading.local):
 
         To force reloading for modified entities, you can pass ``force=True``.
         '''
-        self._init()
         from rom import Model
         force = kwargs.get('force')
         for o in objects:
@@ -691,6 +927,52 @@ class Session(threading.local):
         '''
         self.refresh(*self.known.values(), force=kwargs.get('force'))
 
+class _AutoPipe(object):
+    __slots__ = 'session', 'outer'
+    def __init__(self, session):
+        self.session = session
+        self.outer = False
+
+    def __enter__(self):
+        # nested blocks are written by the outermost block
+        self.outer = self.session.autopiped is None
+        if self.outer:
+            self.session.autopiped = {}
+            self.session.autopiped_locks = []
+        return self.session
+
+    def __exit__(self, typ, value, tb):
+        if not self.outer:
+            return
+        session = self.session
+        queued, locks = session.autopiped, session.autopiped_locks
+        session.autopiped = session.autopiped_locks = None
+        errors = []
+        try:
+            if typ is None:
+                # one pipelined write for each combination of save() arguments,
+                # all of which are written even if an earlier one fails
+                groups = {}
+                for obj, full, force in queued.values():
+                    groups.setdefault((full, force), []).append(obj)
+                for (full, force), objs in groups.items():
+                    try:
+                        session.save(objs, full=full, all=True, force=force)
+                    except Exception as err:
+                        errors.append(err)
+        finally:
+            # release locks after our writes, one round trip per connection
+            c2p = {}
+            for lock in locks:
+                if lock.conn not in c2p:
+                    c2p[lock.conn] = lock.conn.pipeline(False)
+                lock.release(_conn=c2p[lock.conn])
+            errors.extend(result for p in c2p.values() for result in _execute_pipeline(p)
+                if isinstance(result, Exception))
+        # don't replace an exception raised inside the block
+        if errors and typ is None:
+            raise errors[0]
+
 def use_null_session():
     '''
     If you call ``use_null_session()``, you will change the default session for
@@ -716,20 +998,24 @@ def use_rom_session():
 session = Session()
 
 def _get_row_ids(model, block_size):
-    cursor = 0
+    # SCAN pages can be short or even empty before the cursor wraps, so we
+    # gather ids into blocks of up to block_size, until the cursor wraps
+    conn = _connect(model)
     pfx = "%s:"%(model._namespace,)
-    cursor, chunk = model._connection.scan(cursor, pfx + "*", block_size)
-    while chunk:
-        oc = []
+    match = pfx + "*"
+    block = []
+    cursor = None
+    while cursor != 0:
+        cursor, chunk = conn.scan(cursor or 0, match, block_size)
         for v in chunk:
-            vv = v.decode().partition(pfx)
+            vv = (v.decode() if isinstance(v, bytes) else v).partition(pfx)
             if vv[1] == pfx and not vv[0] and vv[2].isdigit():
-                oc.append(int(vv[2]))
-        if oc:
-          yield oc
-        if cursor == 0:
-            break
-        cursor, chunk = model._connection.scan(cursor, pfx + "*", block_size)
+                block.append(int(vv[2]))
+        if len(block) >= block_size:
+            yield block
+            block = []
+    if block:
+        yield block
 
 def refresh_indices(model, block_size=100, scan=True):
     '''
@@ -749,7 +1035,7 @@ def refresh_indices(model, block_size=100, scan=True):
     Example use::
 
         for progress, total in refresh_indices(MyModel, block_size=200):
-            print "%s of %s"%(progress, total)
+            print("%s of %s"%(progress, total))
 
     .. note:: This uses the session object to handle index refresh via calls to
       ``.commit()``. If you have any outstanding entities known in the
@@ -762,7 +1048,7 @@ def refresh_indices(model, block_size=100, scan=True):
         blocks = _get_row_ids(model, block_size)
         count = 0
     else:
-        blocks = (list(range(i, i+block_size)) for i in range(1, max_id+1, block_size))
+        blocks = (range(i, min(i+block_size, max_id+1)) for i in range(1, max_id+1, block_size))
 
     for i, block in enumerate(blocks):
         # fetches entities, keeping a record in the session
@@ -792,6 +1078,9 @@ def refresh_all_indexes():
         show_progress(refresh_indices(m))
 
 
+# how many HSCAN pages _scan_index_lua may walk per call when they're clean
+_SCAN_INDEX_PAGES = 5
+
 def clean_old_index(model, block_size=100, **kwargs):
     '''
     This utility function will clean out old index data that was accidentally
@@ -810,13 +1099,11 @@ def clean_old_index(model, block_size=100, **kwargs):
     Example use::
 
         for progress, total in clean_old_index(MyModel, block_size=200):
-            print "%s of %s"%(progress, total)
+            print("%s of %s"%(progress, total))
     '''
 
     conn = _connect(model)
-    version = list(map(int, conn.info()['redis_version'].split('.')[:2]))
-    has_hscan = version >= [2, 8]
-    pipe = conn.pipeline(True)
+    has_hscan = _redis_version(conn) >= [2, 8]
     prefix = '%s:'%model._namespace
     index = prefix + ':'
     block_size = max(block_size, 10)
@@ -827,27 +1114,29 @@ def clean_old_index(model, block_size=100, **kwargs):
         cursor = None
         scanned = 0
         while cursor != b'0':
-            cursor, remove = _scan_index_lua(conn, [index, prefix], [cursor or '0', block_size, 0, 0])
+            cursor, remove, pages = _scan_index_lua(
+                conn, [index, prefix], [cursor or '0', block_size, 0, 0, _SCAN_INDEX_PAGES])
             if remove:
                 _clean_index_lua(conn, [model._namespace], remove)
 
-            scanned += block_size
+            scanned += block_size * pages
             if scanned > max_id:
                 max_id = scanned + 1
             yield scanned, max_id
 
         # need to scan over unique indexes :/
         for uniq in chain(model._unique, model._cunique):
-            name = uniq if isinstance(uniq, six.string_types) else ':'.join(uniq)
+            name = uniq if isinstance(uniq, str) else ':'.join(uniq)
             idx = prefix + name + ':uidx'
 
             cursor = None
             while cursor != b'0':
-                cursor, remove = _scan_index_lua(conn, [idx, prefix], [cursor or '0', block_size, 1, 0])
+                cursor, remove, pages = _scan_index_lua(
+                    conn, [idx, prefix], [cursor or '0', block_size, 1, 0, _SCAN_INDEX_PAGES])
                 if remove:
                     conn.hdel(idx, *remove)
 
-                scanned += block_size
+                scanned += block_size * pages
                 if scanned > max_id:
                     max_id = scanned + 1
                 yield scanned, max_id
@@ -860,13 +1149,8 @@ def clean_old_index(model, block_size=100, **kwargs):
 
         max_id = int(conn.get('%s%s:'%(prefix, model._pkey)) or '0')
         for i in range(1, max_id+1, block_size):
-            ids = list(range(i, min(i+block_size, max_id+1)))
-            for id in ids:
-                pipe.exists(prefix + str(id))
-                pipe.hexists(index, id)
-
-            result = iter(pipe.execute())
-            remove = [id for id, ent, ind in zip(ids, result, result) if ind and not ent]
+            ids = range(i, min(i+block_size, max_id+1))
+            remove = _check_missing_lua(conn, [prefix, index], ids)
             if remove:
                 _clean_index_lua(conn, [model._namespace], remove)
 
@@ -947,29 +1231,33 @@ def show_progress(job):
         class RomTest(Model):
             pass
 
-        for i in xrange(1000):
+        for i in range(1000):
             RomTest().save()
 
         util.show_progress(util.clean_old_index(RomTest))
     '''
-    start = time.time()
-    last_print = 0
+    start = time.monotonic()
+    last_print = start - 1
     last_line = 0
     for prog, total in chain(job, [(1, 1)]):
+        now = time.monotonic()
         # Only print a line when we start, finish, or every .1 seconds
-        if (time.time() - last_print) > .1 or prog >= total:
-            delta = (time.time() - start) or .0001
+        if (now - last_print) > .1 or prog >= total:
+            delta = (now - start) or .0001
             line = "%.1f%% complete, %.1f seconds elapsed, %.1f seconds remaining"%(
                 100. * prog / (total or 1), delta, total * delta / (prog or 1) - delta)
             length = len(line)
             # pad the line out with spaces just in case our line got shorter
-            line += max(last_line - length, 0) * ' '
-            print(line, end="\r")
+            print(line.ljust(last_line), end="\r")
             last_line = length
-            last_print = time.time()
+            last_print = now
     print()
 
 NO_SCRIPT_MESSAGES = ['NOSCRIPT', 'No matching script.']
+_NO_SCRIPT_TUPLE = tuple(NO_SCRIPT_MESSAGES)
+# sha -> (script, ids of the pools it has been sent over), for re-sending
+# scripts that failed with NOSCRIPT inside a pipeline
+_SCRIPTS = {}
 def _script_load(script):
     '''
     Borrowed/modified from my book, Redis in Action:
@@ -978,101 +1266,215 @@ def _script_load(script):
     Used for Lua scripting support when writing against Redis 2.6+ to allow
     for multiple unique columns per model.
     '''
-    script = script.encode('utf-8') if isinstance(script, six.text_type) else script
-    sha = [None, sha1(script).hexdigest()]
+    script = script.encode('utf-8') if isinstance(script, str) else script
+    sha = sha1(script).hexdigest()
+    # ids of the connection pools we've sent the full script over, so that new
+    # pools (other servers, or re-created after a fork) don't start with a
+    # failed EVALSHA. If the server loses the script anyway, direct calls fall
+    # back to EVAL below, and pipelined calls rely on _execute_pipeline() or
+    # _execute_transaction() to re-send it or to forget the pool.
+    loaded = set()
+    _SCRIPTS[sha] = script, loaded
     def call(conn, keys=[], args=[], force_eval=False):
-        keys = tuple(keys)
-        args = tuple(args)
+        # we may need to send these twice on NOSCRIPT, so no one-shot iterators
+        if not isinstance(keys, (list, tuple)):
+            keys = tuple(keys)
+        if not isinstance(args, (list, tuple)):
+            args = tuple(args)
         if not force_eval:
-            if not sha[0]:
+            pool = id(getattr(conn, 'connection_pool', conn))
+            if pool not in loaded:
                 try:
                     # executing the script implicitly loads it
                     return conn.execute_command(
-                        'EVAL', script, len(keys), *(keys + args))
+                        'EVAL', script, len(keys), *keys, *args)
                 finally:
                     # thread safe by re-using the GIL ;)
-                    del sha[:-1]
+                    loaded.add(pool)
 
             try:
                 return conn.execute_command(
-                    "EVALSHA", sha[0], len(keys), *(keys+args))
+                    "EVALSHA", sha, len(keys), *keys, *args)
 
             except redis.exceptions.ResponseError as msg:
-                if not any(msg.args[0].startswith(nsm) for nsm in NO_SCRIPT_MESSAGES):
+                if not msg.args[0].startswith(_NO_SCRIPT_TUPLE):
                     raise
+                # script cache was flushed, or we're talking to a new server;
+                # the EVAL below re-loads this one
+                _forget_scripts(conn)
 
         return conn.execute_command(
-            "EVAL", script, len(keys), *(keys+args))
+            "EVAL", script, len(keys), *keys, *args)
 
     return call
 
+def _forget_scripts(conn):
+    # NOSCRIPT means the server lost its script cache (SCRIPT FLUSH, restart,
+    # failover), so every script goes back to EVAL on its next call
+    pool = id(getattr(conn, 'connection_pool', conn))
+    for script, loaded in _SCRIPTS.values():
+        loaded.discard(pool)
+
+def _execute_pipeline(pipe):
+    '''
+    Executes a non-transactional pipeline, returning replies and errors in
+    command order, like ``pipe.execute(raise_on_error=False)``.
+
+    Scripts that fail with NOSCRIPT (the script cache was flushed, or the
+    server was restarted or failed over) didn't run, so only those commands
+    are re-sent with EVAL, in one more round trip.
+    '''
+    stack = [args for args, options in pipe.command_stack]
+    results = pipe.execute(raise_on_error=False)
+    retry = [i for i, result in enumerate(results)
+        if isinstance(result, redis.exceptions.NoScriptError)]
+    if retry:
+        _forget_scripts(pipe)
+        for i in retry:
+            pipe.execute_command('EVAL', _SCRIPTS[stack[i][1]][0], *stack[i][2:])
+        for i, result in zip(retry, pipe.execute(raise_on_error=False)):
+            results[i] = result
+    return results
+
+def _execute_transaction(pipe):
+    '''
+    Executes a MULTI/EXEC pipeline. Commands in a transaction can depend on
+    each other, so a script that fails with NOSCRIPT can't be re-run on its
+    own like in ``_execute_pipeline()``. The error is raised, but the pool is
+    dropped from every script's loaded set, so later calls re-send the
+    scripts with EVAL instead of failing again.
+    '''
+    try:
+        return pipe.execute()
+    except redis.exceptions.NoScriptError:
+        _forget_scripts(pipe)
+        raise
+
 _scan_index_lua = _script_load('''
-local page = redis.call('HSCAN', KEYS[1], ARGV[1], 'COUNT', ARGV[2] or 100)
+-- scans up to ARGV[5] pages of the hash, returning early as soon as we have
+-- something to clear, so sparse indexes don't need a round trip per page
+local call = redis.call
+local cursor = ARGV[1]
 local clear = {}
 local skip = tonumber(ARGV[3])
 local exists = tonumber(ARGV[4])
-for i=(1+skip), #page[2], 2 do
-    if redis.call('EXISTS', KEYS[2] .. page[2][i]) == exists then
-        table.insert(clear, page[2][i - skip])
+local max_pages = tonumber(ARGV[5]) or 1
+local pages = 0
+while pages < max_pages do
+    local page = call('HSCAN', KEYS[1], cursor, 'COUNT', ARGV[2] or 100)
+    local fields = page[2]
+    cursor = page[1]
+    pages = pages + 1
+    for i=(1+skip), #fields, 2 do
+        if call('EXISTS', KEYS[2] .. fields[i]) == exists then
+            clear[#clear + 1] = fields[i - skip]
+        end
+    end
+    if #clear > 0 or cursor == '0' then
+        break
     end
 end
 
-return {page[1], clear}
+return {cursor, clear, pages}
+''')
+
+_check_missing_lua = _script_load('''
+-- returns the ids that are still in the index hash, but whose entity is gone
+local call = redis.call
+local missing = {}
+for _, id in ipairs(ARGV) do
+    if call('EXISTS', KEYS[1] .. id) == 0 and call('HEXISTS', KEYS[2], id) == 1 then
+        missing[#missing + 1] = id
+    end
+end
+return missing
 ''')
 
 _clean_index_lua = _script_load('''
 -- remove old index data
 -- [1] string.format("%s", d) will truncate d to the first null value, so we
 --     can't rely on string.format() where we can reasonably expect nulls.
+-- [2] removals are grouped by key, so that every index key gets one variadic
+--     SREM/ZREM (chunked to stay below the unpack() stack limit), instead of
+--     one call per key per id.
 
+local call = redis.call
+local sformat = string.format
+local decode = cjson.decode
 local namespace = KEYS[1]
 local cleaned = 0
+local srem = {}
+local zrem = {}
+local hdel = {}
+
+local function add(grouped, key, member, key2, member2)
+    local members = grouped[key]
+    if not members then
+        members = {}
+        grouped[key] = members
+    end
+    members[#members + 1] = member
+    -- see note [1]
+    if key2 ~= key or member2 ~= member then
+        add(grouped, key2, member2, key2, member2)
+    end
+end
+
+local function remove(command, key, members)
+    for i = 1, #members, 1000 do
+        call(command, key, unpack(members, i, math.min(i + 999, #members)))
+    end
+end
+
 for _, id in ipairs(ARGV) do
-    local idata = redis.call('HGET', namespace .. '::', id)
+    local idata = call('HGET', namespace .. '::', id)
     if idata then
         cleaned = cleaned + 1
-        idata = cjson.decode(idata)
+        hdel[#hdel + 1] = id
+        idata = decode(idata)
         while #idata < 4 do
             idata[#idata + 1] = {}
         end
         for i, key in ipairs(idata[1]) do
-            redis.call('SREM', string.format('%s:%s:idx', namespace, key), id)
-            -- see note [1]
-            redis.call('SREM', namespace .. ':' .. key .. ':idx', id)
+            add(srem, sformat('%s:%s:idx', namespace, key), id,
+                namespace .. ':' .. key .. ':idx', id)
         end
         for i, key in ipairs(idata[2]) do
-            redis.call('ZREM', string.format('%s:%s:idx', namespace, key), id)
-            -- see note [1]
-            redis.call('ZREM', namespace .. ':' .. key .. ':idx', id)
+            add(zrem, sformat('%s:%s:idx', namespace, key), id,
+                namespace .. ':' .. key .. ':idx', id)
         end
         for i, data in ipairs(idata[3]) do
-            local key = string.format('%s:%s:pre', namespace, data[1])
-            local mem = string.format('%s\0%s', data[2], id)
-            redis.call('ZREM', key, mem)
-            -- see note [1]
-            local key = namespace .. ':' .. data[1] .. ':pre'
-            local mem = data[2] .. '\0' .. id
-            redis.call('ZREM', key, mem)
+            add(zrem, sformat('%s:%s:pre', namespace, data[1]),
+                sformat('%s\0%s', data[2], id),
+                namespace .. ':' .. data[1] .. ':pre', data[2] .. '\0' .. id)
         end
         for i, data in ipairs(idata[4]) do
-            local key = string.format('%s:%s:suf', namespace, data[1])
-            local mem = string.format('%s\0%s', data[2], id)
-            redis.call('ZREM', key, mem)
-            -- see note [1]
-            local key = namespace .. ':' .. data[1] .. ':suf'
-            local mem = data[2] .. '\0' .. id
-            redis.call('ZREM', key, mem)
+            add(zrem, sformat('%s:%s:suf', namespace, data[1]),
+                sformat('%s\0%s', data[2], id),
+                namespace .. ':' .. data[1] .. ':suf', data[2] .. '\0' .. id)
         end
-        redis.call('HDEL', namespace .. '::', id)
     end
 end
+
+-- see note [2]
+for key, members in pairs(srem) do
+    remove('SREM', key, members)
+end
+for key, members in pairs(zrem) do
+    remove('ZREM', key, members)
+end
+if #hdel > 0 then
+    remove('HDEL', namespace .. '::', hdel)
+end
 return cleaned
 ''')
 
-def _random_hex(bytes):
-    if six.PY2:
-        return os.urandom(bytes).encode('hex')
-    return binascii.hexlify(os.urandom(bytes))
+def _random_hex(nbytes):
+    # already a str, ready to be sent as-is
+    return os.urandom(nbytes).hex()
+
+# a Lock(..., pubsub=True) waiter that gets one of these falls back to polling
+_PUBSUB_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
 
 class Lock(object):
     '''
@@ -1082,38 +1484,148 @@ class Lock(object):
     Useful for locking over a string key in Redis. Minimally correct for the
     required semantics. Mostly intended as a general building block for use by
     EntityLock.
+
+    While waiting for the lock, retries back off exponentially (with jitter)
+    from ``min_sleep`` up to ``max_sleep`` seconds, so many waiters don't
+    flood Redis with acquire attempts.
+
+    With ``pubsub=True``, releasing the lock publishes a message that waiters
+    subscribe to, so they retry immediately instead of waiting out their
+    backoff. Only releases from locks that also pass ``pubsub=True`` wake
+    waiters (locks that expire still fall back to the backoff), so use it
+    for all users of a long-held lock. Each waiter holds a connection from
+    the pool while it waits (see ``set_connection_settings()``); if the
+    subscription can't get one, waiters fall back to the backoff.
     '''
-    __slots__ = 'identifier', 'conn', 'lockname', 'lock_timeout', 'acquire_timeout'
-    def __init__(self, conn, lockname, acquire_timeout, lock_timeout):
-        self.identifier = None
+    __slots__ = ('identifier', 'conn', 'lockname', 'lock_timeout',
+        'acquire_timeout', 'min_sleep', 'max_sleep', 'pubsub', '_keys')
+    def __init__(self, conn, lockname, acquire_timeout, lock_timeout,
+            min_sleep=.001, max_sleep=1.0, pubsub=False):
+        self.identifier = _random_hex(16)
         self.conn = conn
         self.lockname = 'lock:' + lockname
-        self.lock_timeout = int(math.ceil(lock_timeout))
-        self.acquire_timeout = int(math.ceil(acquire_timeout))
+        # re-used as KEYS for every script call
+        self._keys = (self.lockname,)
+        # timeouts are almost always passed as ints already
+        self.lock_timeout = (lock_timeout if type(lock_timeout) is int
+            else int(math.ceil(lock_timeout)))
+        self.acquire_timeout = (acquire_timeout if type(acquire_timeout) is int
+            else int(math.ceil(acquire_timeout)))
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.pubsub = pubsub
 
     def _acquire(self):
-        self.identifier = self.identifier or str(_random_hex(16))
         return _acquire_refresh_lock_with_timeout_lua(
-            self.conn, [self.lockname], [self.lock_timeout, self.identifier or '']) in ('OK', 1)
+            self.conn, self._keys, (self.lock_timeout, self.identifier)) in (b'OK', 'OK', 1)
+
+    def _retry(self, attempt, wait=time.sleep):
+        # calls attempt() until it returns True or we time out
+        # monotonic, so clock adjustments can't shorten or stretch our wait
+        monotonic = time.monotonic
+        done = False
+        delay = self.min_sleep
+        now = monotonic()
+        end = now + self.acquire_timeout
+        while now < end:
+            done = attempt()
+            if done:
+                break
+
+            # don't sleep past the deadline
+            remaining = end - monotonic()
+            if remaining > 0:
+                wait(min(delay + random.uniform(0, delay * .5), remaining))
+            delay = min(delay * 2, self.max_sleep)
+            now = monotonic()
+
+        return done
 
     def acquire(self):
-        acquired = False
-        end = time.time() + self.acquire_timeout
-        while time.time() < end and not acquired:
-            acquired = self._acquire()
-
-            time.sleep(.001 * (not acquired))
+        # Usually no one holds the lock, and a plain SET NX EX is enough to
+        # take it without running a script. If that fails, we may already
+        # hold it, or need to wait, which the script handles.
+        if self.acquire_timeout > 0 and self.conn.set(
+                self.lockname, self.identifier, nx=True, ex=self.lock_timeout):
+            return True
+        if not self.pubsub:
+            return self._retry(self._acquire)
+
+        # subscribe before retrying, so we can't miss a release
+        waiter = self.conn.pubsub(ignore_subscribe_messages=True)
+        def wait(timeout):
+            try:
+                waiter.get_message(timeout=timeout)
+            except _PUBSUB_ERRORS:
+                time.sleep(timeout)
+        try:
+            try:
+                waiter.subscribe(self.lockname + ':released')
+            except _PUBSUB_ERRORS:
+                # no connection to wait on, poll with backoff instead
+                return self._retry(self._acquire)
+            return self._retry(self._acquire, wait)
+        finally:
+            waiter.close()
+
+    def run_atomic(self, body, keys=(), args=()):
+        '''
+        Runs the Lua script ``body`` with the provided ``keys`` and ``args``
+        while no one else holds this lock, in one round trip, returning the
+        result of the script. Useful for short critical sections that can be
+        expressed in Lua, instead of acquiring, operating, and releasing::
+
+            lock = rom.util.EntityLock(document, 5, 90)
+            views = lock.run_atomic(
+                "return redis.call('INCRBY', KEYS[1], ARGV[1])",
+                [document._pk + ':views'], [1])
+
+        If we already hold the lock, the script is run without releasing it.
+        Waits up to ``acquire_timeout`` for others to release the lock, before
+        raising a ``DataRaceError``.
+        '''
+        script = _atomic_scripts.get(body)
+        if script is None:
+            script = _atomic_scripts[body] = _script_load(_ATOMIC_WRAPPER % body)
+        keys = [self.lockname] + list(keys)
+        args = [self.identifier] + list(args)
+        result = []
+        def attempt():
+            try:
+                result.append(script(self.conn, keys, args))
+            except redis.exceptions.ResponseError as err:
+                if not err.args[0].startswith('ROMLOCKED'):
+                    raise
+                return False
+            return True
 
-        return acquired
+        if not self._retry(attempt):
+            raise DataRaceError("Lock is already held")
+        return result[0]
 
     def refresh(self):
         refreshed = self._acquire()
         if not refreshed:
-            self.identifier = None
+            # we lost the lock, so don't accidentally release someone else's
+            self.identifier = _random_hex(16)
         return refreshed
 
-    def release(self):
-        return bool(_release_lock_lua(self.conn, [self.lockname], [self.identifier or '']))
+    def release(self, wait=True, _conn=None):
+        '''
+        Releases the lock, returning whether we still held it. With
+        ``wait=False`` inside a ``session.autopipe()`` block, the release is
+        queued until the block's deferred writes are done, and this returns
+        ``None``.
+        '''
+        if not wait and session.autopiped_locks is not None:
+            session.autopiped_locks.append(self)
+            return None
+        args = ((self.identifier, self.lockname + ':released') if self.pubsub
+            else (self.identifier,))
+        result = _release_lock_lua(
+            self.conn if _conn is None else _conn, self._keys, args)
+        # pipelined releases don't have a result yet
+        return result if _conn is not None else bool(result)
 
     def __enter__(self):
         if not self.acquire():
@@ -1121,7 +1633,7 @@ class Lock(object):
         return self
 
     def __exit__(self, *args, **kwargs):
-        self.release()
+        self.release(wait=False)
 
 def EntityLock(entity, acquire_timeout, lock_timeout):
     '''
@@ -1142,6 +1654,25 @@ def EntityLock(entity, acquire_timeout, lock_timeout):
     '''
     return Lock(entity._connection, entity._pk, acquire_timeout, lock_timeout)
 
+# Lua bodies passed to Lock.run_atomic() -> loaded scripts
+_atomic_scripts = {}
+
+# Scripts are atomic, so as long as no one else holds the lock, we don't need
+# to acquire and release it around the body. KEYS[1] and ARGV[1] are the lock
+# and our identifier, which are removed so the body sees only its own.
+_ATOMIC_WRAPPER = '''
+local lock = table.remove(KEYS, 1)
+local identifier = table.remove(ARGV, 1)
+local owner = redis.call('get', lock)
+if owner and owner ~= identifier then
+    return redis.error_reply('ROMLOCKED lock is held')
+end
+local function body()
+%s
+end
+return body()
+'''
+
 _acquire_refresh_lock_with_timeout_lua = _script_load('''
 if redis.call('exists', KEYS[1]) == 0 then
     return redis.call('setex', KEYS[1], unpack(ARGV))
@@ -1152,7 +1683,12 @@ end
 
 _release_lock_lua = _script_load('''
 if redis.call('get', KEYS[1]) == ARGV[1] then
-    return redis.call('del', KEYS[1])
+    local deleted = redis.call('del', KEYS[1])
+    -- wake up any Lock(..., pubsub=True) waiters
+    if ARGV[2] then
+        redis.call('publish', ARGV[2], ARGV[1])
+    end
+    return deleted
 end
 ''')
 
@@ -22,7 +22,6 @@ setup(
         'License :: OSI Approved :: GNU Lesser General Public License v2 (LGPLv2)',
         'License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
@@ -32,7 +31,8 @@ setup(
     ],
     license='GNU LGPL v2.1',
     long_description=long_description,
-    requires=['redis', 'six'],
-    install_requires=['redis', 'six'],
+    requires=['redis'],
+    install_requires=['redis'],
+    python_requires='>=3.6',
 )
 
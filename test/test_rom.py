@@ -8,28 +8,33 @@ Released under the LGPL license version 2.1 and version 3 (you can choose
 which you'd like to be bound under).
 '''
 
-from __future__ import print_function
 import base64
 from collections import namedtuple
 from datetime import datetime, timedelta
 from decimal import Decimal as _Decimal
+import os
 import sys
+import threading
 import time
 import unittest
 import warnings
 
 import redis
-import six
 
 from rom import util
 
-util.CONNECTION = redis.Redis(db=15, port=6379, host='redis-data-storage')
+# one pool per test database, shared by every connection the tests create
+POOL15 = redis.BlockingConnectionPool(
+    db=15, port=6379, host='redis-data-storage', max_connections=8)
+POOL14 = redis.BlockingConnectionPool(
+    db=14, port=6379, host='redis-data-storage', max_connections=4)
+util.CONNECTION = redis.Redis(connection_pool=POOL15)
 connect = util._connect
 
 from rom import *
 from rom.exceptions import *
 
-string = String if six.PY2 else Text
+string = Text
 
 def plain2(a, d):
     a = 'attr'
@@ -38,10 +43,21 @@ def plain2(a, d):
 
 def global_setup(a=1):
     c = connect(None)
-    for p in ('RomTest*', 'RestrictA*', 'RestrictB*'):
-        keys = c.keys(p)
-        if keys:
-            c.delete(*keys)
+    if os.environ.get('ROM_TEST_FLUSHDB') == '1':
+        # opted in: nothing else uses this db, so drop everything at once,
+        # and let Redis reclaim the memory in the background
+        c.flushdb(asynchronous=True)
+    else:
+        # SCAN + UNLINK, so cleanup doesn't block Redis on a big keyspace
+        batch = []
+        for p in ('RomTest*', 'RestrictA*', 'RestrictB*', 'lock:RomTest*'):
+            for k in c.scan_iter(match=p, count=500):
+                batch.append(k)
+                if len(batch) >= 500:
+                    c.unlink(*batch)
+                    del batch[:]
+        if batch:
+            c.unlink(*batch)
     if not a:
         return
     from rom.columns import MODELS
@@ -50,32 +66,44 @@ def global_setup(a=1):
         if v is not Model:
             del MODELS[k]
 
+def _scan_keys(conn, pattern, count=1000):
+    # SCAN instead of KEYS, so we don't block a shared server; SCAN can
+    # return a key more than once, hence the set
+    return list(set(conn.scan_iter(match=pattern, count=count)))
+
+def _hexists(conn, key, fields):
+    # one HMGET instead of an HEXISTS round trip per field
+    return [v is not None for v in conn.hmget(key, fields)]
+
 def get_state():
     c = connect(None)
-    data = []
-    for k in c.keys('*'):
-        k = k.decode() if six.PY3 else k
-        t = c.type(k)
-        t = t.decode() if six.PY3 else t
+    keys = [k.decode() for k in c.keys('*')]
+    pipe = c.pipeline(False)
+    for k in keys:
+        pipe.type(k)
+    types = pipe.execute()
+    for k, t in zip(keys, types):
+        t = t.decode()
         if t == 'string':
-            data.append((k, c.get(k)))
+            pipe.get(k)
         elif t == 'list':
-            data.append((k, c.lrange(k, 0, -1)))
+            pipe.lrange(k, 0, -1)
         elif t == 'set':
-            data.append((k, {"set": list(c.smembers(k))}))
+            pipe.smembers(k)
         elif t == 'hash':
-            data.append((k, c.hgetall(k)))
+            pipe.hgetall(k)
         else:
-            data.append((k, c.zrange(k, 0, -1, withscores=True)))
+            pipe.zrange(k, 0, -1, withscores=True)
+    data = []
+    for k, t, v in zip(keys, types, pipe.execute()):
+        t = t.decode()
+        data.append((k, {"set": list(v)} if t == 'set' else v))
     data.sort()
     return data
 
 _now = datetime.utcnow()
 _now_time = time.time()
 
-def _default_time():
-    return _now_time
-
 class TestORM(unittest.TestCase):
     def setUp(self):
         session.rollback()
@@ -90,7 +118,7 @@ class TestORM(unittest.TestCase):
         class RomTestBasicModel(Model):
             val = Integer()
             oval = Integer(default=7)
-            created_at = Float(default=_default_time)
+            created_at = Float(default=_now_time)
             req = Text(required=True)
 
         self.assertRaises(ColumnError, RomTestBasicModel)
@@ -193,7 +221,7 @@ class TestORM(unittest.TestCase):
         x = RomTestO2Mfk()
         x.save()
         ys = [RomTestM2Ofk(ref=x) for z in range(5)]
-        [y.save() for y in ys]
+        session.save(*ys)
 
         del ys[0].ref
         ys[0].save()
@@ -230,6 +258,15 @@ class TestORM(unittest.TestCase):
         a.delete()
         b.save()
 
+        # pipelined session saves still write everything they can
+        session.rollback()
+        d = RomTestUnique(attr='hello')
+        e = RomTestUnique(attr='hello3')
+        self.assertRaises(UniqueKeyViolation, session.commit)
+        self.assertTrue(d._modified)
+        self.assertFalse(e._modified)
+        self.assertEqual(RomTestUnique.get_by(attr='hello3').id, e.id)
+
     def test_saving(self):
         class RomTestNormal(Model):
             attr = Text()
@@ -243,6 +280,150 @@ class TestORM(unittest.TestCase):
 
         self.assertTrue(x is RomTestNormal.get(x.id))
 
+        # entities passed more than once are only written once
+        x.attr = 'world'
+        self.assertEqual(session.save(x, [x, (x,)]), 1)
+        self.assertFalse(x._modified)
+        session.save(x, x, all=True)
+
+    def test_session_save_hooks(self):
+        class RomTestSessionHooks(Model):
+            attr = Text()
+            def _after_insert(self):
+                if self.attr == 'bad':
+                    raise KeyError(self.attr)
+
+        class RomTestSessionOverride(Model):
+            attr = Text()
+            def save(self, full=False, force=False):
+                self.attr = 'overridden'
+                return Model.save(self, full, force)
+
+        # a failing hook doesn't leave the other entities half-saved
+        a = RomTestSessionHooks(attr='bad')
+        b = RomTestSessionHooks(attr='good')
+        self.assertRaises(KeyError, session.save, a, b)
+        self.assertFalse(a._modified or b._modified)
+        b.attr = 'better'
+        b.save()
+
+        # overridden .save() methods are still called
+        c = RomTestSessionOverride(attr='c')
+        session.commit()
+        session.rollback()
+        self.assertEqual(RomTestSessionOverride.get(c.id).attr, 'overridden')
+
+    def test_autopipe(self):
+        class RomTestAutopipe(Model):
+            attr = Integer(index=True)
+
+        items = [RomTestAutopipe(attr=i) for i in range(5)]
+        with session.autopipe():
+            for item in items:
+                self.assertEqual(item.save(), None)
+            self.assertEqual(RomTestAutopipe.query.filter(attr=(0, 10)).count(), 0)
+        self.assertEqual(RomTestAutopipe.query.filter(attr=(0, 10)).count(), 5)
+        self.assertFalse(any(item._modified for item in items))
+
+        # an exception inside the block skips the writes, but leaves the
+        # entities modified for the next commit
+        item = RomTestAutopipe(attr=5)
+        with self.assertRaises(KeyError):
+            with session.autopipe():
+                item.save()
+                raise KeyError
+        self.assertTrue(item._modified)
+        self.assertEqual(RomTestAutopipe.query.filter(attr=(0, 10)).count(), 5)
+        session.commit()
+        self.assertEqual(RomTestAutopipe.query.filter(attr=(0, 10)).count(), 6)
+
+    def test_autopipe_errors(self):
+        class RomTestAutopipeErrors(Model):
+            attr = Integer(index=True)
+            name = string(unique=True)
+            txn = Integer()
+
+        RomTestAutopipeErrors(attr=1, name='a').save()
+        # a failing write doesn't stop the other save() arguments' writes
+        bad = RomTestAutopipeErrors(attr=2, name='a')
+        good = RomTestAutopipeErrors(attr=3, name='b')
+        with self.assertRaises(UniqueKeyViolation):
+            with session.autopipe():
+                bad.save()
+                good.save(full=True)
+        self.assertTrue(bad._modified)
+        self.assertFalse(good._modified)
+        self.assertEqual(RomTestAutopipeErrors.query.filter(attr=(0, 10)).count(), 2)
+
+        # transfer() refreshes the index immediately
+        session.rollback()
+        a = RomTestAutopipeErrors.get_by(name='a')
+        txn = RomTestAutopipeErrors(attr=0, name='txn')
+        txn.save()
+        with session.autopipe():
+            a.transfer(good, 'attr', 1, txn, 'txn')
+            self.assertEqual(RomTestAutopipeErrors.query.filter(attr=4).first().id, good.id)
+
+    def test_autopipe_lock(self):
+        class RomTestAutopipeLock(Model):
+            attr = Integer(index=True)
+
+        conn = connect(None)
+        lock = util.Lock(conn, 'RomTestAutopipeLock', 1, 10)
+        with session.autopipe():
+            with lock:
+                RomTestAutopipeLock(attr=1).save()
+            # exited, but still held until the deferred write is done
+            self.assertTrue(conn.exists(lock.lockname))
+            self.assertEqual(RomTestAutopipeLock.query.filter(attr=(0, 10)).count(), 0)
+        self.assertFalse(conn.exists(lock.lockname))
+        self.assertEqual(RomTestAutopipeLock.query.filter(attr=(0, 10)).count(), 1)
+
+        # deferred releases are re-sent if the server lost the script
+        try:
+            with session.autopipe():
+                with lock:
+                    conn.script_flush()
+            self.assertFalse(conn.exists(lock.lockname))
+        finally:
+            for script, loaded in util._SCRIPTS.values():
+                conn.script_load(script)
+
+    def test_script_flush(self):
+        class RomTestScriptFlush(Model):
+            attr = Integer(index=True)
+            name = string(unique=True)
+            tag = string(prefix=True, keygen=IDENTITY_STRING)
+
+        RomTestScriptFlush(attr=0, name='a').save()
+        conn = connect(None)
+        try:
+            # pipelined writes re-send scripts that the server lost
+            conn.script_flush()
+            for i in range(1, 4):
+                RomTestScriptFlush(attr=i, name=str(i), tag='tag%i'%i)
+            session.commit()
+            self.assertEqual(RomTestScriptFlush.query.filter(attr=(0, 10)).count(), 4)
+
+            # and errors from the re-sent writes are still reported
+            conn.script_flush()
+            RomTestScriptFlush(attr=5, name='5')
+            RomTestScriptFlush(attr=6, name='a')
+            self.assertRaises(UniqueKeyViolation, session.commit)
+            self.assertEqual(RomTestScriptFlush.query.filter(attr=(0, 10)).count(), 5)
+
+            # queries can't re-run part of a MULTI/EXEC, but recover on the
+            # next call
+            query = RomTestScriptFlush.query.startswith(tag='tag')
+            self.assertEqual(query.count(), 3)
+            conn.script_flush()
+            self.assertRaises(redis.exceptions.NoScriptError, query.count)
+            self.assertEqual(query.count(), 3)
+        finally:
+            # put the scripts back for the rest of the tests
+            for script, loaded in util._SCRIPTS.values():
+                conn.script_load(script)
+
     def test_index(self):
         plain = lambda x: [x.lower()] if x else None
         class RomTestIndexedModel(Model):
@@ -264,15 +445,14 @@ class TestORM(unittest.TestCase):
             attr4=4.5,
             attr5=_Decimal('2.643'),
         )
-        x.save()
         RomTestIndexedModel(
             attr='world',
             attr3=100,
             attr4=-1000,
             attr5=_Decimal('2.643'),
-        ).save()
-
-        session.rollback()
+        )
+        # both entities are written in one pipeline
+        session.reset()
 
         self.assertRaises(UniqueKeyViolation, RomTestIndexedModel(
                 attr='world',
@@ -287,11 +467,13 @@ class TestORM(unittest.TestCase):
         self.assertEqual(RomTestIndexedModel.query.filter(attr='hello').filter(attr2='how').filter(attr2='are').count(), 1)
         self.assertRaises(QueryError, lambda: RomTestIndexedModel.query.filter(attr='hello', noattr='bad'))
         self.assertEqual(RomTestIndexedModel.query.filter(attr='hello', attr3=(None, None)).count(), 1)
-        self.assertEqual(RomTestIndexedModel.query.filter(attr='hello', attr3=(None, 10)).count(), 1)
-        self.assertEqual(RomTestIndexedModel.query.filter(attr='hello', attr3=(None, 10)).execute()[0].id, 1)
+        q = RomTestIndexedModel.query.filter(attr='hello', attr3=(None, 10))
+        self.assertEqual(q.count(), 1)
+        self.assertEqual(q.execute()[0].id, 1)
         self.assertEqual(RomTestIndexedModel.query.filter(attr='hello', attr3=(5, None)).count(), 1)
-        self.assertEqual(RomTestIndexedModel.query.filter(attr='hello', attr3=(5, 10), attr4=(4,5), attr5=(2.5, 2.7)).count(), 1)
-        first = RomTestIndexedModel.query.filter(attr='hello', attr3=(5, 10), attr4=(4,5), attr5=(2.5, 2.7)).first()
+        q = RomTestIndexedModel.query.filter(attr='hello', attr3=(5, 10), attr4=(4,5), attr5=(2.5, 2.7))
+        self.assertEqual(q.count(), 1)
+        first = q.first()
         self.assertTrue(first)
         self.assertEqual(first._pk, x._pk)
         self.assertEqual(RomTestIndexedModel.query.filter(attr='hello', attr3=(10, 20), attr4=(4,5), attr5=(2.5, 2.7)).count(), 0)
@@ -300,10 +482,18 @@ class TestORM(unittest.TestCase):
 
         results = RomTestIndexedModel.query.filter(attr='world').order_by('attr4').execute()
         self.assertEqual([y.id for y in results], [2,1])
-
-        for i in range(50):
-            RomTestIndexedModel(attr3=i)
-        session.commit()
+        self.assertEqual(RomTestIndexedModel.query.filter(attr='world').order_by('attr4').ids(), [2,1])
+        q = RomTestIndexedModel.query.filter(attr='world').order_by('attr4')
+        self.assertEqual(q.limit(1, 5).ids(), [1])
+        self.assertEqual(q.limit(-1, 1).ids(), [2])
+        self.assertEqual(q.limit(0, 0).ids(), [])
+        # unfiltered, through the entity keys or the primary key index
+        self.assertEqual(RomTestIndexedModel.query.ids(), [1,2])
+        self.assertEqual(RomTestIndexedModel.query.limit(1, 5).ids(), [2])
+        self.assertEqual(RomTestIndexedModel.query.limit(0, 0).ids(), [])
+
+        # one pipelined write for all 50 entities
+        session.save([RomTestIndexedModel(attr3=i) for i in range(50)])
         session.rollback()
 
         self.assertEqual(len(RomTestIndexedModel.get_by(attr3=(10, 25))), 16)
@@ -374,7 +564,7 @@ class TestORM(unittest.TestCase):
             pass
 
         class RomTestBar(Model):
-            _conn = redis.Redis(db=14, port=6379, host='redis-data-storage')
+            _conn = redis.Redis(connection_pool=POOL14)
 
         RomTestBar._conn.delete('RomTestBar:id:')
 
@@ -391,9 +581,48 @@ class TestORM(unittest.TestCase):
         self.assertEqual(util.CONNECTION.get('RomTestBar:id:'), None)
         RomTestBar.get(1).delete()
         RomTestBar._conn.delete('RomTestBar:id:')
-        k = RomTestBar._conn.keys('RomTest*')
+        k = _scan_keys(RomTestBar._conn, 'RomTest*')
         if k:
-            RomTestBar._conn.delete(*k)
+            RomTestBar._conn.unlink(*k)
+
+    def test_connection_settings(self):
+        old = util.CONNECTION
+        try:
+            util.set_connection_settings(host='redis-data-storage', db=15,
+                max_connections=3, pool_timeout=1)
+            pool = util.CONNECTION.connection_pool
+            self.assertTrue(isinstance(pool, redis.BlockingConnectionPool))
+            self.assertEqual(pool.max_connections, 3)
+            self.assertEqual(pool.timeout, 1)
+            self.assertEqual(pool.connection_kwargs['db'], 15)
+            self.assertTrue(util.CONNECTION.ping())
+
+            # the single connection comes from our pool
+            util.set_connection_settings(host='redis-data-storage', db=15,
+                max_connections=3, single_connection_client=True)
+            pool = util.CONNECTION.connection_pool
+            self.assertTrue(isinstance(pool, redis.BlockingConnectionPool))
+            self.assertTrue(util.CONNECTION.connection is not None)
+            self.assertEqual(len(pool._connections), 1)
+            self.assertTrue(util.CONNECTION.ping())
+            util.CONNECTION.close()
+
+            # bounded by default, like the default connection
+            util.set_connection_settings(host='redis-data-storage', db=15)
+            pool = util.CONNECTION.connection_pool
+            self.assertTrue(isinstance(pool, redis.BlockingConnectionPool))
+            self.assertEqual(pool.max_connections, util.POOL_SIZE)
+            self.assertEqual(pool.timeout, util.POOL_TIMEOUT)
+
+            # opting out, or bringing your own pool
+            util.set_connection_settings(host='redis-data-storage', db=15,
+                max_connections=None)
+            self.assertFalse(isinstance(
+                util.CONNECTION.connection_pool, redis.BlockingConnectionPool))
+            util.set_connection_settings(connection_pool=POOL14)
+            self.assertTrue(util.CONNECTION.connection_pool is POOL14)
+        finally:
+            util.CONNECTION = old
 
     def test_entity_caching(self):
         class RomTestGoo(Model):
@@ -473,13 +702,13 @@ class TestORM(unittest.TestCase):
             col2 = Date(index=True)
             col3 = Time(index=True)
 
-        dtt = RomTestDateTimesTest(col1=_now, col2=_now.date(), col3=_now.time())
+        now_date, now_time = _now.date(), _now.time()
+        dtt = RomTestDateTimesTest(col1=_now, col2=now_date, col3=now_time)
         dtt.save()
-        session.commit()
         del dtt
         self.assertEqual(len(RomTestDateTimesTest.get_by(col1=_now)), 1)
-        self.assertEqual(len(RomTestDateTimesTest.get_by(col2=_now.date())), 1)
-        self.assertEqual(len(RomTestDateTimesTest.get_by(col3=_now.time())), 1)
+        self.assertEqual(len(RomTestDateTimesTest.get_by(col2=now_date)), 1)
+        self.assertEqual(len(RomTestDateTimesTest.get_by(col3=now_time)), 1)
 
     def test_deletion(self):
         class RomTestDeletionTest(Model):
@@ -531,14 +760,16 @@ class TestORM(unittest.TestCase):
             created_at = DateTime(default=datetime.utcnow)
             event_datetime = DateTime(index=True)
 
+        # created_at keeps its callable default; event times share one value
+        utcnow = datetime.utcnow()
         x = RomTestDT()
-        x.event_datetime = datetime.utcnow()
+        x.event_datetime = utcnow
         x.save()
-        RomTestDT(event_datetime=datetime.utcnow()).save()
+        RomTestDT(event_datetime=utcnow).save()
         session.rollback() # clearing the local cache
 
         self.assertEqual(RomTestDT.get_by(event_datetime=(datetime(2000, 1, 1), datetime(2000, 1, 1))), [])
-        self.assertEqual(len(RomTestDT.get_by(event_datetime=(datetime(2000, 1, 1), datetime.utcnow()))), 2)
+        self.assertEqual(len(RomTestDT.get_by(event_datetime=(datetime(2000, 1, 1), utcnow))), 2)
 
     def test_prefix_suffix_pattern(self):
         class RomTestPSP(Model):
@@ -581,7 +812,7 @@ class TestORM(unittest.TestCase):
         self.assertEqual(RomTestPSP.query.like(col3="nope").count(), 0)
 
     def test_unicode_text(self):
-        ch = unichr(0xfeff) if six.PY2 else chr(0xfeff)
+        ch = chr(0xfeff)
         pre = ch + 'hello'
         suf = 'hello' + ch
 
@@ -673,17 +904,11 @@ class TestORM(unittest.TestCase):
             (dict(num=(None, -1)), 0),
         )
         for i, (kwargs, count) in enumerate(ranges):
-            try:
-                st = 1
+            with self.subTest(test=i, range=kwargs, expect=count):
                 self.assertEqual(len(RomTestInfRange.get_by(**kwargs)), count)
-                st = 2
+                # single range counts are one ZCOUNT
                 self.assertEqual(RomTestInfRange.query.filter(**kwargs).count(), count)
-                st = 3
                 self.assertEqual(len(RomTestInfRange.query.filter(**kwargs).execute()), count)
-            except Exception:
-                msg = 'test %d step %d: range %s, expect: %d' % (i, st, kwargs, count)
-                print(msg)
-                raise
 
     def test_big_int(self):
         """ Ensure integers that overflow py2k int work. """
@@ -702,8 +927,7 @@ class TestORM(unittest.TestCase):
 
         for i, num in enumerate(numbers):
             RomTestBigInt(num=num).save()
-            session.commit()
-            session.rollback()
+            session.reset()
             echo = RomTestBigInt.get(i+1).num
             self.assertEqual(num, echo)
 
@@ -763,8 +987,7 @@ class TestORM(unittest.TestCase):
         a = RomTestDelete()
         a.save()
         a.delete()
-        session.commit()
-        session.rollback()
+        session.reset()
         self.assertIsNone(RomTestDelete.get(a.id))
 
         # write-through cache auto-commit (session)
@@ -1006,8 +1229,7 @@ class TestORM(unittest.TestCase):
         for i in range(10):
             RomTestIndexClear(col1=i)
 
-        session.commit()
-        session.rollback()
+        session.reset()
         self.assertEqual(RomTestIndexClear.query.count(), 10)
         self.assertEqual(len(list(RomTestIndexClear.query)), 10)
         self.assertEqual(len(RomTestIndexClear.query.all()), 10)
@@ -1016,10 +1238,10 @@ class TestORM(unittest.TestCase):
         self.assertEqual(len(list(RomTestIndexClear.query.limit(2, 4))), 4)
         self.assertEqual(len(RomTestIndexClear.query.limit(2, 4).all()), 4)
 
-        for j in range(1, 11):
-            RomTestIndexClear.get(j).delete()
+        # one pipelined fetch, then one pipelined delete
+        session.delete(RomTestIndexClear.get(range(1, 11)))
         conn = connect(None)
-        self.assertEqual(conn.hgetall('RomTestIndexClear::'), {})
+        self.assertEqual(conn.hlen('RomTestIndexClear::'), 0)
         self.assertEqual(RomTestIndexClear.query.count(), 10)
         self.assertEqual(RomTestIndexClear.query.filter(col1=(0, 10)).all(), [])
 
@@ -1033,10 +1255,10 @@ class TestORM(unittest.TestCase):
                 ('col1', 'col2', 'col3'),
             ]
 
-        for c1 in range(10):
-            for c2 in range(10):
-                for c3 in ('a', 'b', 'c', 'test', 'blah'):
-                    RomTestCompositeUnique(col1=c1, col2=c2, col3=c3).save()
+        # all 500 entities (and their unique checks) in one pipeline
+        session.save([RomTestCompositeUnique(col1=c1, col2=c2, col3=c3)
+            for c1 in range(10) for c2 in range(10)
+            for c3 in ('a', 'b', 'c', 'test', 'blah')])
 
         self.assertRaises(UniqueKeyViolation, RomTestCompositeUnique(col1=5, col2=5, col3='c').save)
 
@@ -1058,18 +1280,15 @@ class TestORM(unittest.TestCase):
             col1 = Integer(index=True)
             alternate = Integer(required=True)
 
-        ids = []
-        for i in range(1, 51):
-            a = RomTestIterResult(col1=i, alternate=1)
-            a.save()
-            ids.append(a._id)
-
+        session.save([RomTestIterResult(col1=i, alternate=1) for i in range(1, 51)])
         session.rollback()
         total = 0
         for it in RomTestIterResult.query.order_by('col1').iter_result(30, 10):
             total += it.col1
         session.rollback()
         self.assertEqual(total, 50 * 51 / 2)
+        self.assertEqual(RomTestIterResult.query.limit(1, 3).ids(), [2, 3, 4])
+        self.assertEqual(RomTestIterResult.query.ids(), list(range(1, 51)))
 
         # test no decoding
         total = 0
@@ -1241,34 +1460,32 @@ class TestORM(unittest.TestCase):
         # okay, now test for longer scan/clear.
         minid = int(c.get('RomTestNamespacedCleanup:id:')) + 1
         _count = 200
-        for i in range(minid, minid+_count):
-            RomTestCleanOld(col1=i, col3=str(i)).save()
+        session.save([RomTestCleanOld(col1=i, col3=str(i)) for i in range(minid, minid+_count)])
         session.rollback()
 
-        version = list(map(int, c.info()['redis_version'].split('.')[:2]))
-        has_hscan = version >= [2, 8]
+        has_hscan = util._redis_version(c) >= [2, 8]
         if has_hscan:
             self.assertEqual(len(RomTestCleanOld.query.all()), _count)
 
         to_delete = list(range(minid, minid + _count, 37))
         c.delete(*['RomTestNamespacedCleanup:%i'%i for i in to_delete])
-        self.assertTrue(all(c.hexists('RomTestNamespacedCleanup::', i) for i in to_delete))
+        self.assertTrue(all(_hexists(c, 'RomTestNamespacedCleanup::', to_delete)))
         all(util.clean_old_index(RomTestCleanOld, 10, force_hscan=has_hscan))
-        self.assertTrue(all(not c.hexists('RomTestNamespacedCleanup::', i) for i in to_delete))
+        self.assertFalse(any(_hexists(c, 'RomTestNamespacedCleanup::', to_delete)))
         if has_hscan:
-            self.assertTrue(all(not c.hexists('RomTestNamespacedCleanup:col3:uidx', i) for i in to_delete))
+            self.assertFalse(any(_hexists(c, 'RomTestNamespacedCleanup:col3:uidx', to_delete)))
 
         to_delete = list(range(minid+29, minid + _count, 29))
         c.delete(*['RomTestNamespacedCleanup:%i'%i for i in to_delete])
-        #self.assertTrue(all(c.hexists('RomTestNamespacedCleanup::', i) for i in to_delete))
+        #self.assertTrue(all(_hexists(c, 'RomTestNamespacedCleanup::', to_delete)))
         # should cause a warning
         with warnings.catch_warnings(record=True) as w:
             all(util.clean_old_index(RomTestCleanOld, 10, force_hscan=None))
             self.assertEqual(len(w), 1)
-        self.assertTrue(all(not c.hexists('RomTestNamespacedCleanup::', i) for i in to_delete))
+        self.assertFalse(any(_hexists(c, 'RomTestNamespacedCleanup::', to_delete)))
         # We can't really clean out unique indexes when hscan is disabled or not
         # available. :/
-        self.assertTrue(all(c.hexists('RomTestNamespacedCleanup:col3:uidx', i) for i in to_delete))
+        self.assertTrue(all(_hexists(c, 'RomTestNamespacedCleanup:col3:uidx', to_delete)))
 
     def test_multi_query(self):
         class RomTestIndexMultiCol(Model):
@@ -1314,9 +1531,9 @@ class TestORM(unittest.TestCase):
         session.add(a)
 
         # make sure no strange keys make it through
-        self.assertEqual(util.CONNECTION.keys('TestNamespace*'), [])
+        self.assertEqual(_scan_keys(util.CONNECTION, 'TestNamespace*'), [])
         # make sure that there are keys named as we wanted them named
-        self.assertTrue(len(util.CONNECTION.keys('RomTestNamespace*')) > 0)
+        self.assertTrue(len(_scan_keys(util.CONNECTION, 'RomTestNamespace*')) > 0)
 
         # verify that our indexes work the way we want them to...
         self.assertEqual(a.get_by(test_i=4), [a])
@@ -1565,8 +1782,7 @@ class TestORM(unittest.TestCase):
     def test_binary(self, RomTestBinaryData=None, bad=None):
         if not bad:
             bad = base64.b64decode(b'UEsDBBQAAAAIACUdX0djd8CXNQEAAAoCAAAYAAAAeGwvd29ya3NoZQ==')
-            if six.PY3:
-                bad = bad.decode('latin-1')
+            bad = bad.decode('latin-1')
 
         if not RomTestBinaryData:
             class RomTestBinaryData(Model):
@@ -1580,20 +1796,14 @@ class TestORM(unittest.TestCase):
         session.rollback()
         d = RomTestBinaryData.get(id)
         ## print(type(dv), type(bad))
-        if six.PY3:
-            # This right here is ridiculous. The 2.x way was 10x better.
-            ## print(binascii.hexlify(d.value))
-            ## print(binascii.hexlify(bad.encode('latin-1')))
-            self.assertEqual(d.value, bad.encode('latin-1'))
-        else:
-            ## print(d.value.encode('hex'))
-            ## print(bad.encode('hex'))
-            self.assertEqual(d.value, bad)
+        # This right here is ridiculous. The 2.x way was 10x better.
+        ## print(binascii.hexlify(d.value))
+        ## print(binascii.hexlify(bad.encode('latin-1')))
+        self.assertEqual(d.value, bad.encode('latin-1'))
 
     def test_geo(self):
         conn = connect(None)
-        version = list(map(int, conn.info()['redis_version'].split('.')))
-        if version < [3, 2]:
+        if util._redis_version(conn) < [3, 2]:
             print("Skipping geo tests")
             return
 
@@ -1626,11 +1836,9 @@ class TestORM(unittest.TestCase):
 
         TEST_PERF = 0
 
-        ids = []
-        for i in range(10000 if TEST_PERF else 100):
-            a = RomTestFilterPerformance()
-            a.save()
-            ids.append(a.id)
+        items = [RomTestFilterPerformance() for i in range(10000 if TEST_PERF else 100)]
+        session.save(items)
+        ids = [a.id for a in items]
         session.rollback()
 
         if TEST_PERF:
@@ -1674,7 +1882,84 @@ class TestORM(unittest.TestCase):
         l2 = util.EntityLock(a, 1, 1)
         self.assertFalse(l2.acquire())
         self.assertTrue(l.refresh())
+
+        # held by l, so only l can run atomic operations
+        body = "return redis.call('INCRBY', KEYS[1], ARGV[1])"
+        key = 'RomTestModelLock:counter'
+        self.assertEqual(l.run_atomic(body, [key], [2]), 2)
+        self.assertRaises(DataRaceError, l2.run_atomic, body, [key], [2])
         self.assertTrue(l.release())
+        self.assertEqual(l2.run_atomic(body, [key], [3]), 5)
+
+    def test_lock_backoff(self):
+        conn = connect(None)
+        # sleeps double from min_sleep (plus up to 50% jitter), up to max_sleep
+        lock = util.Lock(conn, 'RomTestLockBackoff', 5, 10, min_sleep=.01, max_sleep=.1)
+        attempts = []
+        sleeps = []
+        attempt = lambda: attempts.append(1) or len(attempts) > 8
+        self.assertTrue(lock._retry(attempt, sleeps.append))
+        self.assertEqual(len(sleeps), 8)
+        for t, delay in zip(sleeps, [.01, .02, .04, .08, .1, .1, .1, .1]):
+            self.assertTrue(delay <= t <= delay * 1.5, (t, delay))
+
+        # no sleep goes past the acquire timeout
+        lock = util.Lock(conn, 'RomTestLockBackoff', 1, 10, min_sleep=5, max_sleep=5)
+        sleeps = []
+        def wait(t):
+            sleeps.append(t)
+            time.sleep(t)
+        self.assertFalse(lock._retry(lambda: False, wait))
+        self.assertTrue(sleeps and max(sleeps) <= 1)
+
+        # a held lock fails within the acquire timeout
+        held = util.Lock(conn, 'RomTestLockBackoff', 1, 10)
+        self.assertTrue(held.acquire())
+        start = time.monotonic()
+        self.assertFalse(util.Lock(conn, 'RomTestLockBackoff', 1, 10).acquire())
+        self.assertTrue(time.monotonic() - start < 1.5)
+        self.assertTrue(held.release())
+
+        # contending acquirers both get the lock, one after the other
+        acquired = []
+        def worker():
+            with util.Lock(conn, 'RomTestLockBackoff', 5, 10, max_sleep=.05):
+                acquired.append(1)
+                time.sleep(.1)
+        threads = [threading.Thread(target=worker) for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(acquired), 2)
+
+    def test_lock_pubsub(self):
+        conn = connect(None)
+        held = util.Lock(conn, 'RomTestLockPubsub', 5, 10, pubsub=True)
+        self.assertTrue(held.acquire())
+        threading.Timer(.2, held.release).start()
+        # the release wakes us up well before the backoff would
+        waiter = util.Lock(conn, 'RomTestLockPubsub', 5, 10, min_sleep=3, max_sleep=3, pubsub=True)
+        start = time.monotonic()
+        self.assertTrue(waiter.acquire())
+        self.assertTrue(time.monotonic() - start < 2)
+        self.assertTrue(waiter.release())
+
+        # without a pubsub connection, waiters poll instead
+        class NoPubsub(redis.Redis):
+            def pubsub(self, **kwargs):
+                waiter = redis.Redis.pubsub(self, **kwargs)
+                def subscribe(*args, **kwargs):
+                    raise redis.exceptions.ConnectionError("No connection available.")
+                waiter.subscribe = subscribe
+                return waiter
+
+        self.assertTrue(held.acquire())
+        threading.Timer(.2, held.release).start()
+        waiter = util.Lock(NoPubsub(connection_pool=conn.connection_pool),
+            'RomTestLockPubsub', 5, 10, max_sleep=.05, pubsub=True)
+        self.assertTrue(waiter.acquire())
+        self.assertTrue(waiter.release())
 
     def test_empty_keygen_result(self):
         class RomTestEmptyKeygen(Model):
@@ -1689,6 +1974,20 @@ class TestORM(unittest.TestCase):
         b = RomTestEmptyKeygen.get(aid)
         self.assertTrue(b.col)
 
+    def test_numeric_keygen(self):
+        # mixed-type columns score values like the single-type columns do
+        dt = datetime(2020, 1, 2, 3, 4, 5, 678)
+        self.assertEqual(util._numeric_keygen(dt), util._date_keygen(dt))
+        self.assertEqual(util._numeric_keygen(dt.date()), util._date_keygen(dt.date()))
+        self.assertEqual(util._numeric_keygen(dt.time()), util._time_keygen(dt.time()))
+        self.assertEqual(util._numeric_keygen(1.5), {'': '1.5'})
+
+        # subclasses use their base class format
+        class MyFloat(float):
+            pass
+        self.assertEqual(util._numeric_keygen(MyFloat(.1)), {'': '0.1'})
+        self.assertEqual(util._numeric_keygen(MyFloat(.1)), {'': '0.1'})
+
     def test_type_check_datetime(self):
         class RomTestCheckedColumns(Model):
             c = SaferDateTime()